@@ -0,0 +1,56 @@
+"""compact enum lists
+
+Revision ID: 9f4c3b2a6e1d
+Revises: 0bc3f2cc3a80
+Create Date: 2020-06-21 11:42:37.118204
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9f4c3b2a6e1d'
+down_revision = '0bc3f2cc3a80'
+branch_labels = None
+depends_on = None
+
+# enum lists become "602,603", the remaining JSON columns lose their whitespace
+ENUM_LISTS = {'game': ('gid', ['cards', 'steps']), 'role': ('uid', ['skills', 'tags'])}
+JSON_COLUMNS = {'game': ('gid', ['players', 'history']), 'role': ('uid', ['args'])}
+
+
+def _to_compact(value):
+    if not value.startswith('['):
+        return value
+    return ','.join(str(e['__GameEnum__']) for e in json.loads(value))
+
+
+def _to_json(value):
+    if value.startswith('['):
+        return value
+    return json.dumps([{'__GameEnum__': int(v)} for v in value.split(',')] if value else [])
+
+
+def _strip_json(value):
+    return json.dumps(json.loads(value), separators=(',', ':'))
+
+
+def _convert(columns, convert):
+    conn = op.get_bind()
+    for table, (pk, names) in columns.items():
+        t = sa.table(table, sa.column(pk), *[sa.column(n) for n in names])
+        for row in conn.execute(sa.select([t.c[pk]] + [t.c[n] for n in names])).fetchall():
+            conn.execute(t.update().where(t.c[pk] == row[0]).values(
+                {n: convert(row[i + 1]) for i, n in enumerate(names)}))
+
+
+def upgrade():
+    _convert(ENUM_LISTS, _to_compact)
+    _convert(JSON_COLUMNS, _strip_json)
+
+
+def downgrade():
+    _convert(ENUM_LISTS, _to_json)
@@ -0,0 +1,254 @@
+"""
+Micro-benchmarks of the game engine hot paths, compared with the stored baseline.
+
+    python scripts/bench_engine.py [--only move_on_cycle,vote_tally] [--repeat 7] [--threshold 0.2]
+    python scripts/bench_engine.py --save
+
+The game and its roles live in an in-memory SQLite session and messages go to the in-memory
+broadcaster, so what is timed is the engine as a live game runs it. Results are compared with
+scripts/bench_engine_baseline.json, a benchmark slower than its baseline by more than the threshold
+is reported as a regression and the exit status is 1. --save stores the results as the new baseline,
+baselines are only comparable on the same machine and Python, and on a quiet one.
+"""
+from pathlib import Path
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import sys
+import time
+from dotenv import load_dotenv
+load_dotenv()
+
+root = Path(__file__).resolve().parents[1]
+sys.path.append(str(root))
+os.environ['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+os.environ['REDIS_URL'] = 'memory://'
+from sqlalchemy import create_engine  # noqa
+from sqlalchemy.orm import sessionmaker  # noqa
+from sqlalchemy.pool import StaticPool  # noqa
+from werewolf.utils.enums import GameEnum  # noqa
+from werewolf.engine import Engine  # noqa
+from werewolf.models import Base, Game, Role  # noqa
+from werewolf.models.base import JSONEncodedType  # noqa
+from werewolf.runtime.store import LiveGame  # noqa
+from werewolf.websocket.websocket import broadcaster  # noqa
+from bench_json import HISTORY  # noqa
+
+BASELINE = root / 'scripts/bench_engine_baseline.json'
+# positions 1-3 villagers, 4-6 wolves, then seer, witch, hunter and savior
+CARDS = [GameEnum.ROLE_TYPE_VILLAGER] * 3 + [GameEnum.ROLE_TYPE_NORMAL_WOLF] * 3 + [
+    GameEnum.ROLE_TYPE_SEER, GameEnum.ROLE_TYPE_WITCH, GameEnum.ROLE_TYPE_HUNTER, GameEnum.ROLE_TYPE_SAVIOR]
+SEATS = range(1, len(CARDS) + 1)
+
+
+class Table(object):
+    """A dealt game held by a LiveGame as the server holds it, put back to the dealt state before every timed call."""
+
+    def __init__(self, db):
+        game = Game(host_uid=1, victory_mode=GameEnum.VICTORY_MODE_KILL_GROUP,
+                    captain_mode=GameEnum.CAPTAIN_MODE_WITH_CAPTAIN, witch_mode=GameEnum.WITCH_MODE_CAN_SAVE_SELF,
+                    wolf_mode=Game.get_wolf_mode_by_cards(CARDS), cards=list(CARDS))
+        game.init_game()
+        db.add(game)
+        db.flush()
+        for pos in SEATS:
+            role = Role(uid=pos, gid=game.gid, nickname=f'p{pos}', avatar=1)
+            role.reset()
+            role.position = pos
+            db.add(role)
+        db.commit()
+        self.live = LiveGame(db, game)
+        for card, role in zip(CARDS, self.live.game.roles):
+            role.role_type = card
+            role.prepare(game.captain_mode)
+        self.game.status = GameEnum.GAME_STATUS_READY
+        self.game.players = [r.uid for r in self.game.roles]
+        self.live.persist()
+        self._dealt = self.save()
+
+    @property
+    def game(self):
+        return self.live.game
+
+    def save(self):
+        return self.live.game.copy()
+
+    def restore(self, state=None):
+        self.live.restore((state or self._dealt).copy())
+
+    def move_on(self):
+        ret = self.live.transition(Engine.move_on)
+        assert ret['code'] == GameEnum.OK.value, ret
+
+
+def play_day(table):
+    """Night 1 to night 2: a saved kill, captain election, a wolf voted out, as the endpoints would do it."""
+    game, history = table.game, table.game.history
+    table.move_on()  # night falls, the wolves' turn
+    history['wolf_kill_decision'] = 3
+    table.move_on()  # seer
+    history['discover'] = 4
+    table.move_on()  # witch
+    history['elixir'] = True
+    table.move_on()  # savior
+    history['guard'] = GameEnum.TARGET_NO_ONE.value
+    table.move_on()  # day breaks, captain election
+    for pos in (1, 2):
+        table.game.at(pos).tags.append(GameEnum.TAG_ELECT)
+    table.move_on()  # candidates talk
+    table.move_on()  # captain vote
+    game.history['vote_result'] = {str(p): 1 for p in game.history['voter_votee'][0]}
+    table.move_on()  # peaceful night announced, talk
+    table.move_on()  # vote
+    game.history['vote_result'] = {str(p): 4 if p != 4 else 5 for p in game.history['voter_votee'][0]}
+    table.move_on()  # skills of the dying
+    table.move_on()  # last words
+    table.move_on()  # night 2, the wolves' turn
+
+
+def check_play_day(table):
+    table.restore()
+    play_day(table)
+    game = table.game
+    assert (game.days, game.current_step(), game.captain_pos) == (2, GameEnum.TAG_ATTACKABLE_WOLF, 1), \
+        (game.days, game.current_step(), game.captain_pos)
+    assert [p for p in SEATS if not table.game.at(p).alive] == [4]
+
+
+def vote_state(table, votes):
+    table.restore()
+    game = table.game
+    game.steps = [GameEnum.TURN_STEP_VOTE, GameEnum.TURN_STEP_USE_SKILLS, GameEnum.TURN_STEP_LAST_WORDS]
+    game.now_index = 0
+    game.status = GameEnum.GAME_STATUS_DAY
+    game.history['voter_votee'] = [list(SEATS), list(SEATS)]
+    game.history['vote_result'] = {str(p): votes(p) for p in SEATS}
+    return table.save()
+
+
+def night_state(table):
+    table.restore()
+    table.game.history.update(wolf_kill_decision=3, elixir=False, guard=GameEnum.TARGET_NO_ONE.value, toxic=5)
+    return table.save()
+
+
+def benchmarks(table):
+    """name -> (fn, setup or None, ops per round)"""
+    live = table.live
+    voted_out = vote_state(table, lambda p: 4 if p != 4 else 5)
+    tied = vote_state(table, lambda p: 4 if p % 2 else 5)
+    night = night_state(table)
+    column = JSONEncodedType(1023)
+    history_encoded = column.process_bind_param(HISTORY, None)
+    players = list(range(1, 13))
+    players_encoded = column.process_bind_param(players, None)
+
+    def prepare_all():
+        for role in live.game.roles:
+            role.prepare(live.game.captain_mode)
+
+    def reset_tags():
+        for role in live.game.roles:
+            role.tags = []
+
+    return {
+        'move_on_cycle': (lambda: play_day(table), table.restore, 200),
+        'vote_tally': (lambda: live.transition(Engine.leave_step), lambda: table.restore(voted_out), 2000),
+        'vote_tally_tie': (lambda: live.transition(Engine.leave_step), lambda: table.restore(tied), 2000),
+        'calculate_die_in_night': (lambda: live.transition(Engine.calculate_die_in_night), lambda: table.restore(night), 2000),
+        'check_win': (lambda: live.transition(Engine.check_win), None, 20000),
+        'role_prepare': (prepare_all, reset_tags, 2000),
+        'json_encode_history': (lambda: column.process_bind_param(HISTORY, None), None, 20000),
+        'json_decode_history': (lambda: column.process_result_value(history_encoded, None), None, 20000),
+        'json_encode_players': (lambda: column.process_bind_param(players, None), None, 20000),
+        'json_decode_players': (lambda: column.process_result_value(players_encoded, None), None, 20000),
+    }
+
+
+def measure(loop, fn, setup, number, repeat):
+    """Best of `repeat` rounds, in seconds per call, setup is not timed."""
+    best = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()  # as timeit does, a collection would land on whichever call happens to trigger it
+        if setup is None:
+            start = time.perf_counter()
+            for _ in range(number):
+                fn()
+            elapsed = time.perf_counter() - start
+        else:
+            elapsed = 0
+            for _ in range(number):
+                setup()
+                start = time.perf_counter()
+                fn()
+                elapsed += time.perf_counter() - start
+        gc.enable()
+        best = min(best, elapsed / number)
+        # let the publisher take the queued messages between rounds
+        loop.run_until_complete(asyncio.sleep(0.01))
+    return best
+
+
+def report(results, baseline, threshold):
+    regressions = []
+    print(f'{"benchmark":<26}{"baseline us":>13}{"current us":>13}{"change":>9}')
+    for name, seconds in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f'{name:<26}{"-":>13}{seconds * 1e6:>13.2f}')
+            continue
+        change = seconds / base - 1
+        flag = ''
+        if change > threshold:
+            flag = '  SLOWER'
+            regressions.append(name)
+        elif change < -threshold:
+            flag = '  faster'
+        print(f'{name:<26}{base * 1e6:>13.2f}{seconds * 1e6:>13.2f}{change:>+9.1%}{flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', help='comma separated benchmarks to run')
+    parser.add_argument('--repeat', type=int, default=7, help='rounds per benchmark, the best one counts')
+    parser.add_argument('--scale', type=float, default=1, help='multiplies the calls per round')
+    parser.add_argument('--threshold', type=float, default=0.2, help='slowdown reported as a regression')
+    parser.add_argument('--save', action='store_true', help='store the results as the new baseline')
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(broadcaster.connect())
+    engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)()
+    table = Table(db)
+    check_play_day(table)
+
+    selected = benchmarks(table)
+    if args.only:
+        selected = {name: selected[name] for name in args.only.split(',')}
+    results = {name: measure(loop, fn, setup, max(1, int(number * args.scale)), args.repeat)
+               for name, (fn, setup, number) in selected.items()}
+    loop.run_until_complete(broadcaster.disconnect())
+
+    stored = json.loads(BASELINE.read_text()) if BASELINE.exists() else {}
+    regressions = report(results, stored.get('seconds', {}), args.threshold)
+    if args.save:
+        stored.setdefault('seconds', {}).update(results)
+        stored['machine'] = {'python': platform.python_version(), 'platform': platform.platform(),
+                             'processor': platform.processor() or platform.machine()}
+        BASELINE.write_text(json.dumps(stored, indent=2, sort_keys=True) + '\n')
+        print(f'baseline saved to {BASELINE.relative_to(root)}')
+    elif regressions:
+        print(f'regressions: {", ".join(regressions)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
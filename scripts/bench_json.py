@@ -0,0 +1,85 @@
+"""
+Encode/decode throughput of the column and message payloads, old JSON path vs the current one.
+
+    python scripts/bench_json.py [number]
+"""
+from pathlib import Path
+import os
+import sys
+import json
+import timeit
+from dotenv import load_dotenv
+load_dotenv()
+
+root = Path(__file__).resolve().parents[1]
+sys.path.append(str(root))
+os.environ['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+os.environ['REDIS_URL'] = 'memory://'
+from werewolf.utils.enums import GameEnum  # noqa
+from werewolf.utils.json_utils import dumps, loads, json_hook  # noqa
+from werewolf.models.base import EnumListType  # noqa
+
+# a 12 seat room on its first day, with captain election and a pk vote
+STEPS = [GameEnum.TURN_STEP_TURN_NIGHT, GameEnum.TAG_ATTACKABLE_WOLF, GameEnum.ROLE_TYPE_SEER,
+         GameEnum.ROLE_TYPE_WITCH, GameEnum.ROLE_TYPE_SAVIOR, GameEnum.TURN_STEP_TURN_DAY,
+         GameEnum.TURN_STEP_ELECT, GameEnum.TURN_STEP_ELECT_TALK, GameEnum.TURN_STEP_ELECT_VOTE,
+         GameEnum.TURN_STEP_ELECT_PK_TALK, GameEnum.TURN_STEP_ELECT_PK_VOTE, GameEnum.TURN_STEP_ANNOUNCE,
+         GameEnum.TURN_STEP_USE_SKILLS, GameEnum.TURN_STEP_LAST_WORDS, GameEnum.TURN_STEP_TALK,
+         GameEnum.TURN_STEP_VOTE, GameEnum.TURN_STEP_PK_TALK, GameEnum.TURN_STEP_PK_VOTE,
+         GameEnum.TURN_STEP_USE_SKILLS, GameEnum.TURN_STEP_LAST_WORDS]
+HISTORY = {
+    'wolf_kill': {'2': 7, '5': 7, '9': 7, '11': 7},
+    'wolf_kill_decision': 7,
+    'elixir': False,
+    'guard': 3,
+    'toxic': 6,
+    'discover': 9,
+    'voter_votee': [[1, 2, 4, 5, 8, 10, 12], [3, 9, 11]],
+    'vote_result': {'1': 3, '2': 9, '4': 3, '5': 11, '8': 3, '10': 9, '12': -1},
+    'dying': {'6': True, '7': True},
+}
+MESSAGE = {'game': {'next_step': '结束投票', 'status': GameEnum.TURN_STEP_VOTE}, 'mutation': 'SOCKET_GAME'}
+
+
+def legacy_default(o):
+    if isinstance(o, GameEnum):
+        return {'__GameEnum__': o.value}
+    raise TypeError(o)
+
+
+def legacy_dumps(o):
+    return json.dumps(o, default=legacy_default)
+
+
+def legacy_loads(s):
+    return json.loads(s, object_hook=json_hook)
+
+
+def bench(label, fn, number):
+    seconds = timeit.timeit(fn, number=number)
+    print(f'{label:<32}{number / seconds:>14,.0f} ops/s')
+
+
+def main(number):
+    steps_type = EnumListType(1023)
+    steps_legacy, steps_compact = legacy_dumps(STEPS), steps_type.process_bind_param(STEPS, None)
+    history_legacy, history_compact = legacy_dumps(HISTORY), dumps(HISTORY)
+    assert steps_type.process_result_value(steps_compact, None) == STEPS == legacy_loads(steps_legacy)
+    assert loads(history_compact) == HISTORY == legacy_loads(history_legacy)
+    print(f'steps   {len(steps_legacy)} -> {len(steps_compact)} chars')
+    print(f'history {len(history_legacy)} -> {len(history_compact)} chars')
+
+    bench('steps encode, json+tag', lambda: legacy_dumps(STEPS), number)
+    bench('steps encode, EnumListType', lambda: steps_type.process_bind_param(STEPS, None), number)
+    bench('steps decode, json+hook', lambda: legacy_loads(steps_legacy), number)
+    bench('steps decode, EnumListType', lambda: steps_type.process_result_value(steps_compact, None), number)
+    bench('history encode, json', lambda: legacy_dumps(HISTORY), number)
+    bench('history encode, ujson', lambda: dumps(HISTORY), number)
+    bench('history decode, json+hook', lambda: legacy_loads(history_legacy), number)
+    bench('history decode, ujson', lambda: loads(history_compact), number)
+    bench('message encode, json', lambda: json.dumps(MESSAGE, default=lambda o: o.value), number)
+    bench('message encode, ujson', lambda: dumps(MESSAGE), number)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,386 @@
+"""
+End-to-end load test: bots register, log in, fill rooms and play whole games through the game API
+while holding info_ws open, then throughput, latency percentiles per endpoint and WebSocket delivery
+lag are reported.
+
+    python scripts/load_test.py [--rooms 10] [--games 2] [--url http://host:port]
+
+Without --url a server is started on a free port, backed by a fresh SQLite file and the in-memory
+broadcaster (REDIS_URL=memory://), so nothing else has to run. Needs the websockets package.
+"""
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from urllib.parse import urlencode, urlparse
+from dotenv import load_dotenv
+load_dotenv()
+
+root = Path(__file__).resolve().parents[1]
+sys.path.append(str(root))
+DB_PATH = Path(tempfile.gettempdir()) / 'werewolf_load_test.db'
+if '--url' not in sys.argv:
+    # this process creates the tables of the server started below, both use these
+    os.environ['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{DB_PATH}'
+    os.environ['REDIS_URL'] = 'memory://'
+    os.environ['BCRYPT_ROUNDS'] = '4'  # keep signing up the bots short, it is not what is measured
+import websockets  # noqa
+from werewolf.core.config import settings  # noqa
+from werewolf.utils.enums import GameEnum  # noqa
+
+# 10 seats, so that every endpoint of api/game.py has someone to call it
+ROOM = {
+    'victoryMode': GameEnum.VICTORY_MODE_KILL_GROUP.value,
+    'captainMode': GameEnum.CAPTAIN_MODE_WITH_CAPTAIN.value,
+    'witchMode': GameEnum.WITCH_MODE_CAN_SAVE_SELF.value,
+    'villagerCnt': 3,
+    'normalWolfCnt': 3,
+    'selectedGods': [GameEnum.ROLE_TYPE_SEER.value, GameEnum.ROLE_TYPE_WITCH.value,
+                     GameEnum.ROLE_TYPE_HUNTER.value, GameEnum.ROLE_TYPE_SAVIOR.value],
+    'selectedWolves': [],
+}
+SEATS = 10
+VOTE_STEPS = (GameEnum.TURN_STEP_VOTE, GameEnum.TURN_STEP_ELECT_VOTE, GameEnum.TURN_STEP_PK_VOTE,
+              GameEnum.TURN_STEP_ELECT_PK_VOTE)
+NIGHT_ROLES = (GameEnum.ROLE_TYPE_SEER, GameEnum.ROLE_TYPE_WITCH, GameEnum.ROLE_TYPE_SAVIOR)
+REQUEST_TIMEOUT = 30
+MAX_ROUNDS = 300  # a game still running after this many rounds is given up as stuck
+
+
+class Stats(object):
+    def __init__(self):
+        self.latency = defaultdict(list)  # endpoint -> seconds
+        self.rejected = defaultdict(int)  # endpoint -> answers with another code than OK
+        self.failed = defaultdict(int)  # endpoint -> HTTP errors
+        self.ws_lag = []
+        self.ws_messages = 0
+        self.games = 0
+        self.stuck = 0
+
+
+stats = Stats()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0
+
+
+class Http(object):
+    """A keep-alive HTTP/1.1 connection, just enough for the JSON API."""
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self._reader = self._writer = None
+
+    async def request(self, method, path, params=None, headers=None, json_body=None, form=None):
+        body = b''
+        headers = dict(headers or {})
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif form is not None:
+            body = urlencode(form).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if params:
+            path += '?' + urlencode(params)
+        head = f'{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(body)}\r\n'
+        head += ''.join(f'{k}: {v}\r\n' for k, v in headers.items()) + '\r\n'
+        for attempt in (0, 1):
+            if self._writer is None:
+                self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+            try:
+                self._writer.write(head.encode() + body)
+                return await asyncio.wait_for(self._read_response(), REQUEST_TIMEOUT)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self.close()
+                if attempt:
+                    raise
+
+    async def _read_response(self):
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionResetError('closed by the server')  # e.g. the keep-alive timed out
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = (await self._reader.readline()).decode().strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.lower()] = value.strip()
+        body = await self._reader.readexactly(int(headers.get('content-length', 0)))
+        if headers.get('connection') == 'close':
+            self.close()
+        return status, headers, body
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class Bot(object):
+    def __init__(self, room, index, address):
+        self.room = room
+        self.name = f'bot{uuid.uuid4().hex[:10]}'
+        self.position = index + 1
+        self.http = Http(*address)
+        self.token = None
+        self.etag = None
+        self.game = {}
+        self.role = {}
+        self._ws_task = None
+
+    async def call(self, endpoint, method='GET', path_suffix='', command=True, **kwargs):
+        headers = kwargs.pop('headers', {})
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        if command:
+            self.room.last_command_at = time.perf_counter()
+        start = time.perf_counter()
+        try:
+            status, response_headers, body = await self.http.request(
+                method, settings.API_PREFIX + endpoint + path_suffix, headers=headers, **kwargs)
+        except asyncio.TimeoutError:
+            self.http.close()
+            status, response_headers, body = 0, {}, b''
+        stats.latency[endpoint].append(time.perf_counter() - start)
+        if status == 304:
+            return None, response_headers
+        if status != 200:
+            stats.failed[endpoint] += 1
+            return {}, response_headers
+        data = json.loads(body)
+        if 'code' in data and data['code'] != GameEnum.OK.value:
+            stats.rejected[endpoint] += 1
+        return data, response_headers
+
+    async def sign_up(self):
+        await self.call('/user/create', 'POST', command=False,
+                        json_body={'username': self.name, 'password': self.name, 'nickname': self.name[-6:]})
+        data, _ = await self.call('/auth/access-token', 'POST', command=False,
+                                  form={'username': self.name, 'password': self.name})
+        self.token = data['access_token']
+
+    async def info(self):
+        headers = {'If-None-Match': self.etag} if self.etag else {}
+        data, response_headers = await self.call('/game/info', command=False, headers=headers)
+        if data:
+            self.game, self.role = data['game'], data['role']
+            self.etag = response_headers.get('etag')
+
+    async def act(self, endpoint, **params):
+        data, _ = await self.call(endpoint, params=params)
+        return data
+
+    def open_ws(self, url):
+        self._ws_task = asyncio.ensure_future(self._listen(url))
+
+    async def _listen(self, url):
+        async with websockets.connect(f'{url}{settings.WEBSOCKET_URL}?token={self.token}') as ws:
+            async for message in ws:
+                stats.ws_messages += 1
+                if self.room.last_command_at is not None:
+                    stats.ws_lag.append(time.perf_counter() - self.room.last_command_at)
+
+    async def close_ws(self):
+        if self._ws_task is not None:
+            self._ws_task.cancel()
+            await asyncio.gather(self._ws_task, return_exceptions=True)
+            self._ws_task = None
+
+
+class Room(object):
+    """SEATS bots playing games one after the other, each bot plays its role sensibly enough to finish."""
+
+    def __init__(self, address, url):
+        self.url = url
+        self.bots = [Bot(self, i, address) for i in range(SEATS)]
+        self.host = self.bots[0]
+        self.last_command_at = None  # WebSocket lag is measured from the latest command sent to the room
+        self.captain = None
+
+    async def run(self, games):
+        await asyncio.gather(*[b.sign_up() for b in self.bots])
+        for _ in range(games):
+            await self.play()
+        for b in self.bots:
+            b.http.close()
+
+    async def play(self):
+        data, _ = await self.host.call('/game/create', 'POST', json_body=ROOM)
+        gid = data['gid']
+        for b in self.bots:
+            await b.call('/game/join', path_suffix=f'/{gid}')
+            await b.act('/game/sit', position=b.position)
+            b.etag = None
+            b.open_ws(self.url)
+        await self.host.act('/game/deal')
+        await asyncio.gather(*[b.info() for b in self.bots])
+        self.roles = {b.position: GameEnum(b.role['role_type']) for b in self.bots}
+        self.captain = None
+        await self.host.act('/game/next_step')
+        last, unchanged = None, 0
+        for _ in range(MAX_ROUNDS):
+            await asyncio.gather(*[b.info() for b in self.bots])
+            status = GameEnum(self.host.game['status'])
+            if status in (GameEnum.GAME_STATUS_WAIT_TO_START, GameEnum.GAME_STATUS_FINISHED):
+                stats.games += 1
+                break
+            if status in NIGHT_ROLES and self.bot(status) is None:
+                # the server has no timeout yet for the night step of a dead role, the game waits forever
+                stats.stuck += 1
+                break
+            unchanged = unchanged + 1 if (status, self.host.etag) == last else 0
+            last = (status, self.host.etag)
+            if unchanged > 3:
+                await self.host.act('/game/next_step')
+            else:
+                await self.step(status)
+        else:
+            stats.stuck += 1
+        await asyncio.gather(*[b.act('/game/quit') for b in self.bots])
+        await asyncio.gather(*[b.close_ws() for b in self.bots])
+
+    def alive(self):
+        return [p['pos'] for p in self.host.game['players'] if p['alive']]
+
+    def bot(self, role_type):
+        alive = self.alive()
+        return next((b for b in self.bots if self.roles[b.position] is role_type and b.position in alive), None)
+
+    def victim(self, exclude=()):
+        alive = [p for p in self.alive() if p not in exclude and self.roles[p] is not GameEnum.ROLE_TYPE_NORMAL_WOLF]
+        return min(alive) if alive else GameEnum.TARGET_NO_ONE.value
+
+    async def step(self, status):
+        alive = self.alive()
+        wolves = [p for p in alive if self.roles[p] is GameEnum.ROLE_TYPE_NORMAL_WOLF]
+        if status is GameEnum.TAG_ATTACKABLE_WOLF:
+            target = self.victim()
+            await asyncio.gather(*[self.bots[p - 1].act('/game/wolf_kill', target=target) for p in wolves])
+        elif status is GameEnum.ROLE_TYPE_SEER:
+            seer = self.bot(GameEnum.ROLE_TYPE_SEER)
+            await seer.act('/game/discover', target=random.choice([p for p in alive if p != seer.position]))
+        elif status is GameEnum.ROLE_TYPE_WITCH:
+            witch = self.bot(GameEnum.ROLE_TYPE_WITCH)
+            killed = int((await witch.act('/game/witch')).get('result', -1))
+            if killed <= 0 or (await witch.act('/game/elixir')).get('code') != GameEnum.OK.value:
+                await witch.act('/game/toxic', target=GameEnum.TARGET_NO_ONE.value)
+        elif status is GameEnum.ROLE_TYPE_SAVIOR:
+            savior = self.bot(GameEnum.ROLE_TYPE_SAVIOR)
+            if (await savior.act('/game/guard', target=random.choice(alive))).get('code') != GameEnum.OK.value:
+                await savior.act('/game/guard', target=GameEnum.TARGET_NO_ONE.value)
+        elif status is GameEnum.TURN_STEP_ELECT:
+            await asyncio.gather(*[self.bots[p - 1].act('/game/elect', choice='yes' if p in alive[:2] else 'no')
+                                   for p in alive])
+            self.captain = alive[0]
+            await self.host.act('/game/next_step')
+        elif status is GameEnum.TURN_STEP_ELECT_TALK and len(alive) > 1 and random.random() < 0.5:
+            await self.bots[alive[1] - 1].act('/game/elect', choice='quit')
+        elif status in VOTE_STEPS:
+            if status in (GameEnum.TURN_STEP_ELECT_VOTE, GameEnum.TURN_STEP_ELECT_PK_VOTE):
+                target = self.captain or alive[0]
+            else:
+                target = wolves[0] if wolves else self.victim()
+            await asyncio.gather(*[self.bots[p - 1].act('/game/vote', target=target if target != p else -1)
+                                   for p in alive])
+            await self.host.act('/game/next_step')
+        elif status is GameEnum.TURN_STEP_USE_SKILLS:
+            hunter = self.bot(GameEnum.ROLE_TYPE_HUNTER)
+            if hunter is not None:
+                await hunter.act('/game/shoot', target=wolves[0] if wolves else -1)
+            if self.captain in alive and len(alive) > 1:
+                successor = random.choice([p for p in alive if p != self.captain])
+                if (await self.bots[self.captain - 1].act('/game/handover', target=successor)).get('code') == 1:
+                    self.captain = successor
+            await self.host.act('/game/next_step')
+        elif status is GameEnum.TURN_STEP_TALK and self.host.game['days'] > 1 and wolves and random.random() < 0.2:
+            await self.bots[wolves[0] - 1].act('/game/suicide')
+        else:
+            await self.host.act('/game/next_step')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server():
+    from werewolf.db.session import engine
+    from werewolf.models import Base
+    if DB_PATH.exists():
+        DB_PATH.unlink()
+    Base.metadata.create_all(bind=engine)
+    port = free_port()
+    server = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'werewolf:app', '--port', str(port),
+                               '--log-level', 'warning'], cwd=str(root))
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server, f'http://127.0.0.1:{port}'
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError('the server did not come up')
+
+
+def report(elapsed, rooms):
+    requests = sum(len(v) for v in stats.latency.values())
+    print(f'{rooms} rooms, {stats.games} games finished, {stats.stuck} stuck, {elapsed:.1f}s')
+    print(f'{requests / elapsed:,.0f} requests/s, {stats.games / elapsed * 60:,.1f} games/min')
+    print(f'\n{"endpoint":<22}{"count":>8}{"rejected":>10}{"failed":>8}{"p50 ms":>9}{"p90 ms":>9}{"p99 ms":>9}'
+          f'{"max ms":>9}')
+    for endpoint, values in sorted(stats.latency.items()):
+        print(f'{endpoint:<22}{len(values):>8}{stats.rejected[endpoint]:>10}{stats.failed[endpoint]:>8}'
+              + ''.join(f'{percentile(values, p) * 1000:>9.1f}' for p in (.5, .9, .99, 1)))
+    lag = stats.ws_lag
+    print(f'\nWebSocket: {stats.ws_messages} messages, lag p50 {percentile(lag, .5) * 1000:.1f}ms, '
+          f'p90 {percentile(lag, .9) * 1000:.1f}ms, p99 {percentile(lag, .99) * 1000:.1f}ms, '
+          f'max {percentile(lag, 1) * 1000:.1f}ms')
+
+
+async def run(url, rooms, games):
+    parsed = urlparse(url)
+    address = (parsed.hostname, parsed.port or 80)
+    ws_url = url.replace('http', 'ws', 1)
+    start = time.perf_counter()
+    await asyncio.gather(*[Room(address, ws_url).run(games) for _ in range(rooms)])
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rooms', type=int, default=10, help='rooms played at the same time')
+    parser.add_argument('--games', type=int, default=2, help='games played in each room')
+    parser.add_argument('--url', help='a running server, e.g. http://127.0.0.1:8000')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    server = None
+    url = args.url
+    if url is None:
+        server, url = start_server()
+    try:
+        elapsed = asyncio.get_event_loop().run_until_complete(run(url, args.rooms, args.games))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    report(elapsed, args.rooms)
+
+
+if __name__ == '__main__':
+    main()
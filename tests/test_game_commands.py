@@ -0,0 +1,62 @@
+"""
+Game commands called by a user without a role in the live game.
+
+    python -m pytest tests
+"""
+from pathlib import Path
+import os
+import sys
+
+root = Path(__file__).resolve().parents[1]
+sys.path.append(str(root))
+os.environ['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+os.environ['REDIS_URL'] = 'memory://'
+import pytest  # noqa
+from sqlalchemy import create_engine  # noqa
+from sqlalchemy.orm import sessionmaker  # noqa
+from sqlalchemy.pool import StaticPool  # noqa
+from werewolf.api import game as api  # noqa
+from werewolf.models import Base, Game, Role  # noqa
+from werewolf.runtime.store import LiveGame  # noqa
+from werewolf.utils.enums import GameEnum  # noqa
+
+CARDS = [GameEnum.ROLE_TYPE_VILLAGER, GameEnum.ROLE_TYPE_NORMAL_WOLF, GameEnum.ROLE_TYPE_SEER]
+STRANGER = 99
+
+
+@pytest.fixture
+def live():
+    engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)()
+    game = Game(host_uid=1, victory_mode=GameEnum.VICTORY_MODE_KILL_GROUP,
+                captain_mode=GameEnum.CAPTAIN_MODE_WITH_CAPTAIN, witch_mode=GameEnum.WITCH_MODE_CAN_SAVE_SELF,
+                wolf_mode=Game.get_wolf_mode_by_cards(CARDS), cards=list(CARDS))
+    game.init_game()
+    db.add(game)
+    db.flush()
+    for pos in range(1, len(CARDS) + 1):
+        role = Role(uid=pos, gid=game.gid, nickname=f'p{pos}', avatar=1)
+        role.reset()
+        db.add(role)
+    db.commit()
+    yield LiveGame(db, game)
+    db.close()
+
+
+@pytest.mark.parametrize('fn, args', [
+    (api._sit, (1,)),
+    (api._vote, (1,)),
+    (api._handover, (1,)),
+    (api._elect, ('yes',)),
+    (api._wolf_kill, (1,)),
+    (api._discover, (1,)),
+    (api._witch, ()),
+    (api._elixir, ()),
+    (api._toxic, (1,)),
+    (api._guard, (1,)),
+    (api._shoot, (1,)),
+    (api._suicide, ()),
+])
+def test_command_without_role(live, fn, args):
+    assert fn(live, STRANGER, *args)['code'] == GameEnum.GAME_MESSAGE_CANNOT_ACT.value
@@ -1,23 +1,27 @@
+import asyncio
 from fastapi import FastAPI, Request
 from fastapi.logger import logger
 import logging
 from starlette.middleware.cors import CORSMiddleware
-from sqlalchemy.exc import SQLAlchemyError
 
 from werewolf.api import api_router
 # from werewolf.api.sio import sio_app
-from werewolf.websocket.websocket import broadcaster, init_websocket
+from werewolf.websocket.websocket import broadcaster, init_websocket, listen_principal_invalidation
 from werewolf.core.config import settings
+from werewolf.db.executor import db_executor
+from werewolf.core.security import shutdown_hash_pool
 from werewolf.utils.game_exceptions import GameFinished
 from werewolf.utils.enums import GameEnum
+from werewolf.utils.json_utils import UJSONResponse
 from werewolf.websocket.websocket import publish_history
-from werewolf.models import Game, Role
+from werewolf.runtime.store import game_store
+from werewolf.runtime.router import game_router
 
 gunicorn_logger = logging.getLogger('gunicorn.error')
 logger.handlers = gunicorn_logger.handlers
 logger.setLevel(gunicorn_logger.level)
 
-app = FastAPI()
+app = FastAPI(default_response_class=UJSONResponse)
 
 if settings.BACKEND_CORS_ORIGINS:
     app.add_middleware(
@@ -37,12 +41,21 @@ init_websocket(app)
 
 @app.on_event("startup")
 async def startup_event():
+    # sync dependencies and endpoints share the sized pool with the game actors
+    asyncio.get_event_loop().set_default_executor(db_executor)
     await broadcaster.connect()
+    await game_router.start()
+    app.state.principal_listener = asyncio.create_task(listen_principal_invalidation())
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    app.state.principal_listener.cancel()
+    await game_router.stop()
+    game_store.persist_all()
     await broadcaster.disconnect()
+    db_executor.shutdown()
+    shutdown_hash_pool()
 
 
 # @app.middleware("http")
@@ -71,30 +84,6 @@ async def shutdown_event():
 #             return GameEnum.OK.digest()
 #     return response
 
-@app.exception_handler(GameFinished)
-async def game_finished_handler(request: Request, finish: GameFinished):
-    try:
-        db = finish.db
-        db.commit()
-        publish_history(finish.gid, f'游戏结束，{finish.winner.label}胜利')
-        game = db.query(Game).with_for_update().get(finish.gid)
-        game.status = GameEnum.GAME_STATUS_FINISHED
-        original_players = game.players
-        game.init_game()
-        game.players = original_players
-        all_players = db.query(Role).filter(Role.gid == game.gid).all()
-        for p in all_players:
-            p.reset()
-        db.commit()
-    except SQLAlchemyError:
-        db.rollback()
-        raise
-    finally:
-        db.rollback()
-        db.close()
-    return GameEnum.OK.digest()
-
-
 ###
 # test
 ###
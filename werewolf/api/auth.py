@@ -8,33 +8,54 @@ from sqlalchemy.orm import Session
 from werewolf.models import User
 from werewolf.schemas.token import Token
 from . import deps
+from .timing import TimedRoute
 from werewolf.core import security
 from werewolf.core.config import settings
+from werewolf.db.executor import run_in_db
 # from werewolf.utils import (
 #     generate_password_reset_token,
 #     send_reset_password_email,
 #     verify_password_reset_token,
 # )
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
+
+
+def _find_user(db: Session, username: str) -> User:
+    user = db.query(User).filter(User.username == username).first()
+    # hand the connection back while the password is checked, the user stays loaded
+    db.close()
+    return user
+
+
+def _rehash(db: Session, user: User, new_hash: str):
+    db.add(user)
+    user.hashed_password = new_hash
+    db.commit()
 
 
 @router.post("/access-token", response_model=Token)
-def login_access_token(db: Session = Depends(deps.get_db), form_data: OAuth2PasswordRequestForm = Depends()) -> Any:
+async def login_access_token(db: Session = Depends(deps.get_db), form_data: OAuth2PasswordRequestForm = Depends()) -> Any:
     """
     OAuth2 compatible token login, get an access token for future requests
     """
-    user = db.query(User).filter(User.username == form_data.username).first()
+    user = await run_in_db(_find_user, db, form_data.username)
     if not user:
         raise HTTPException(status_code=422, detail="Incorrect email or password")
-    if not security.verify_password(form_data.password, user.hashed_password):
+    valid, new_hash = await security.check_password(form_data.password, user.hashed_password)
+    if not valid:
         raise HTTPException(status_code=422, detail="Incorrect email or password")
     if not user.is_active:
         raise HTTPException(status_code=422, detail="Inactive user")
+    # read before the rehash, its commit expires the user and a later read would query on the loop
+    uid = user.uid
+    if new_hash:
+        # stored with another cost factor
+        await run_in_db(_rehash, db, user, new_hash)
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     return {
         "access_token": security.create_access_token(
-            user.uid, expires_delta=access_token_expires
+            uid, expires_delta=access_token_expires
         ),
         "token_type": "bearer",
     }
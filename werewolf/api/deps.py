@@ -1,6 +1,7 @@
+import secrets
 from typing import Generator
 
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, Header, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt
 from pydantic import ValidationError
@@ -10,6 +11,7 @@ from sqlalchemy.exc import SQLAlchemyError
 from werewolf import models, schemas
 from werewolf.core import security
 from werewolf.core.config import settings
+from werewolf.core.principal import Principal, principal_cache
 from werewolf.db.session import SessionLocal
 
 reusable_oauth2 = OAuth2PasswordBearer(
@@ -30,6 +32,51 @@ def get_db() -> Generator:
         db.close()
 
 
+def get_principal(token: str) -> Principal:
+    """
+    Verified (uid, gid, is_active) of a token, from the principal cache when possible.
+    """
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[security.ALGORITHM])
+        token_data = schemas.token.TokenPayload(**payload)
+    except (jwt.JWTError, ValidationError):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Could not validate credentials",
+        )
+    generation = principal_cache.generation(token_data.sub)
+    db = SessionLocal()
+    try:
+        user = db.query(models.User).get(token_data.sub)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        principal = Principal(user.uid, user.gid, user.is_active)
+    finally:
+        db.close()
+    principal_cache.put(token, principal, payload['exp'], generation)
+    return principal
+
+
+def get_current_active_principal(token: str = Depends(reusable_oauth2)) -> Principal:
+    principal = get_principal(token)
+    if not principal.is_active:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    return principal
+
+
+def verify_metrics_token(authorization: str = Header(None)) -> None:
+    if not settings.METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not secrets.compare_digest((authorization or '').encode(), f'Bearer {settings.METRICS_TOKEN}'.encode()):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Could not validate credentials",
+        )
+
+
 def get_current_user(db: Session = Depends(get_db), token: str = Depends(reusable_oauth2)) -> models.User:
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[security.ALGORITHM])
@@ -1,30 +1,37 @@
 # from typing import Any
 from datetime import datetime
 import random
-import json
 import logging
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Header, Response
 from sqlalchemy.orm import Session
 # from sqlalchemy.exc import IntegrityError
 from collections import Counter
 
 from werewolf.schemas import schema_in, schema_out
-from werewolf.models import User, Game, Role
+from werewolf.models import User, Game
 from werewolf.api import deps
-from werewolf.websocket.websocket import publish_info, publish_history
+from werewolf.api.timing import TimedRoute
+from werewolf.core.principal import Principal
+from werewolf.db.executor import run_in_db
+from werewolf.engine import Engine
+from werewolf.websocket.websocket import publish_info, publish_game, publish_history, invalidate_principal
+from werewolf.runtime.store import game_store, LiveGame
+from werewolf.runtime.router import game_router, command
 # from werewolf.core.config import settings
 from werewolf.utils.enums import GameEnum
+from werewolf.utils.json_utils import dumps
 # from werewolf.utils.game_exceptions import GameFinished
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
 
 @router.post("/create", response_model=schema_out.GameCreateOut)
 async def create_game(
     *,
     db: Session = Depends(deps.get_db),
-    current_user: User = Depends(deps.get_current_active_user),
+    current_user: Principal = Depends(deps.get_current_active_principal),
     game_in: schema_in.GameCreateIn,
 ):
     cards = [GameEnum.ROLE_TYPE_VILLAGER] * game_in.villagerCnt + [GameEnum.ROLE_TYPE_NORMAL_WOLF] * game_in.normalWolfCnt
@@ -40,85 +47,92 @@ async def create_game(
                     )
     new_game.init_game()
     db.add(new_game)
-    db.commit()
+    await run_in_db(db.commit)
 
     return GameEnum.OK.digest(gid=new_game.gid)
 
 
-@router.get("/join/{gid}", response_model=schema_out.ResponseBase)
-async def join_game(
-    *,
-    db: Session = Depends(deps.get_db),
-    current_user: User = Depends(deps.get_current_active_user),
-    gid: int,
-):
-    game = db.query(Game).with_for_update().get(gid)
-    if not game or datetime.utcnow() > game.end_time:
+def _set_user_gid(db: Session, uid: int, gid: int):
+    db.query(User).filter(User.uid == uid).update({User.gid: gid})
+    db.commit()
+    invalidate_principal(uid)
+
+
+@command
+def _join_game(live: LiveGame, uid: int):
+    if not live or datetime.utcnow() > live.game.end_time:
         return GameEnum.GAME_MESSAGE_GAME_NOT_EXIST.digest()
+    game = live.game
     if game.status is not GameEnum.GAME_STATUS_WAIT_TO_START:
         return GameEnum.GAME_MESSAGE_ALREADY_STARTED.digest()
-    if current_user.uid in game.players:
-        current_user.gid = gid
-        db.commit()
+    if uid in game.players:
         return GameEnum.GAME_MESSAGE_ALREADY_IN.digest()
     if len(game.players) >= game.get_seats_cnt():
         return GameEnum.GAME_MESSAGE_GAME_FULL.digest()
 
     # fine to join the game
-    game.players.append(current_user.uid)
-    current_user.gid = gid
-    current_role = db.query(Role).get(current_user.uid)
-    current_role.gid = gid
-    current_role.reset()
-    db.commit()
+    game.players.append(uid)
+    live.add_role(uid)
+    game.invalidate_snapshot()
+    game_store.save(live, now=True)
     return GameEnum.OK.digest()
 
 
-@router.get("/quit", response_model=schema_out.ResponseBase)
-async def quit(
+@router.get("/join/{gid}", response_model=schema_out.ResponseBase)
+async def join_game(
     *,
     db: Session = Depends(deps.get_db),
-    current_user: User = Depends(deps.get_current_active_user),
+    current_user: Principal = Depends(deps.get_current_active_principal),
+    gid: int,
 ):
-    gid = current_user.gid
-    if gid < 0:
-        return GameEnum.GAME_MESSAGE_NOT_IN_GAME.digest()
+    ret = await game_router.call(gid, _join_game, current_user.uid)
+    if ret['code'] in [GameEnum.OK.value, GameEnum.GAME_MESSAGE_ALREADY_IN.value]:
+        await run_in_db(_set_user_gid, db, current_user.uid, gid)
+    return ret
+
 
-    game = db.query(Game).with_for_update().get(gid)
-    if not game or datetime.utcnow() > game.end_time:
-        current_user.gid = -1
-        db.commit()
+@command
+def _quit(live: LiveGame, uid: int):
+    if not live or datetime.utcnow() > live.game.end_time:
         return GameEnum.GAME_MESSAGE_NOT_IN_GAME.digest()
+    game = live.game
     if game.status is not GameEnum.GAME_STATUS_WAIT_TO_START:
         pass  # todo easy to quit??
-    if current_user.uid not in game.players:
-        current_user.gid = -1
-        db.commit()
+    if uid not in game.players:
         return GameEnum.GAME_MESSAGE_NOT_IN_GAME.digest()
-    game.players.remove(current_user.uid)
-    current_user.gid = -1
-    current_role = db.query(Role).get(current_user.uid)
-    current_role.gid = -1
-    current_role.reset()
-    db.commit()
+    game.players.remove(uid)
+    live.remove_role(uid)
+    game.invalidate_snapshot()
+    game_store.save(live, now=True)
     return GameEnum.OK.digest()
 
 
-@router.get("/deal", response_model=schema_out.ResponseBase)
-async def deal(
+@router.get("/quit", response_model=schema_out.ResponseBase)
+async def quit(
     *,
     db: Session = Depends(deps.get_db),
-    current_user: User = Depends(deps.get_current_active_user),
+    current_user: Principal = Depends(deps.get_current_active_principal),
 ):
-    game = db.query(Game).with_for_update().get(current_user.gid)
-    if not game or datetime.utcnow() > game.end_time:
+    gid = current_user.gid
+    if gid < 0:
+        return GameEnum.GAME_MESSAGE_NOT_IN_GAME.digest()
+
+    ret = await game_router.call(gid, _quit, current_user.uid)
+    await run_in_db(_set_user_gid, db, current_user.uid, -1)
+    return ret
+
+
+@command
+def _deal(live: LiveGame, uid: int):
+    if not live or datetime.utcnow() > live.game.end_time:
         return GameEnum.GAME_MESSAGE_CANNOT_START.digest()
+    game = live.game
     if game.status is not GameEnum.GAME_STATUS_WAIT_TO_START:
         return GameEnum.GAME_MESSAGE_CANNOT_START.digest()
     players_cnt = len(game.players)
     if players_cnt != game.get_seats_cnt():
         return GameEnum.GAME_MESSAGE_CANNOT_START.digest()
-    players = db.query(Role).filter_by(gid=game.gid).limit(players_cnt).all()
+    players = list(live.roles.values())
     if len(players) != players_cnt:
         return GameEnum.GAME_MESSAGE_CANNOT_START.digest()
     for p in players:
@@ -136,30 +150,33 @@ async def deal(
     for p, c in zip(players, cards):
         p.role_type = c
         p.prepare(game.captain_mode)
-    db.commit()
-    publish_info(game.gid, json.dumps({
+    game.invalidate_snapshot()
+    game_store.save(live, now=True)
+    publish_info(game.gid, dumps({
         'action': 'getGameInfo'
     }))
     publish_history(game.gid, "身份牌已发放")
     return GameEnum.OK.digest()
 
 
-@router.get("/info", response_model=schema_out.GameInfoOut, response_model_exclude_unset=True)
-async def info(
+@router.get("/deal", response_model=schema_out.ResponseBase)
+async def deal(
     *,
-    db: Session = Depends(deps.get_db),
-    current_user: User = Depends(deps.get_current_active_user),
+    current_user: Principal = Depends(deps.get_current_active_principal),
 ):
-    game = db.query(Game).get(current_user.gid)
-    if not game:
-        return GameEnum.GAME_MESSAGE_NOT_IN_GAME.digest()
-    all_players = db.query(Role).filter(Role.gid == game.gid).limit(len(game.players)).all()
-    role = db.query(Role).get(current_user.uid)
-    return GameEnum.OK.digest(
-        game={
+    return await game_router.call(current_user.gid, _deal, current_user.uid)
+
+
+def _public_state(live: LiveGame) -> dict:
+    # the same for every player, rebuilt only after GameState.invalidate_snapshot
+    key = live.snapshot_key
+    state = live.public_states.get(key)
+    if state is None:
+        game = live.game
+        state = {
             'gid': game.gid,
             'days': game.days,
-            'players': [{'pos': p.position, 'nickname': p.nickname, 'avatar': p.avatar, 'alive': p.alive} for p in all_players],
+            'players': [{'pos': p.position, 'nickname': p.nickname, 'avatar': p.avatar, 'alive': p.alive} for p in live.roles.values()],
             'status': game.current_step() if game.status in [GameEnum.GAME_STATUS_DAY, GameEnum.GAME_STATUS_NIGHT] else game.status,
             'seat_cnt': game.get_seats_cnt(),
             'victoryMode': game.victory_mode,
@@ -167,7 +184,39 @@ async def info(
             'witchMode': game.witch_mode,
             'next_step': game.get_instruction_string(),
             'cards': Counter(game.cards)
-        },
+        }
+        live.remember_public_state(key, state)
+    return state
+
+
+def _state_delta(old: dict, new: dict) -> dict:
+    delta = {k: v for k, v in new.items() if k != 'players' and old.get(k) != v}
+    old_players, new_players = old['players'], new['players']
+    if sorted(p['pos'] for p in old_players) != sorted(p['pos'] for p in new_players) or \
+            len({p['pos'] for p in new_players}) != len(new_players):
+        # players joined, left or are not seated yet, positions do not identify them
+        delta['players'] = new_players
+    else:
+        old_by_pos = {p['pos']: p for p in old_players}
+        changed = [p for p in new_players if old_by_pos[p['pos']] != p]
+        if changed:
+            delta['players'] = changed
+    return delta
+
+
+@command(readonly=True)
+def _info(live: LiveGame, uid: int, known_versions: list = (), since: str = None):
+    if not live or uid not in live.roles:
+        return GameEnum.GAME_MESSAGE_NOT_IN_GAME.digest()
+    version = live.version
+    if version in known_versions:
+        return GameEnum.OK.digest(version=version, not_modified=True)
+    game = live.game
+    role = live.role(uid)
+    state = _public_state(live)
+    base = live.public_states.get(since.split('.')[0]) if since is not None else None
+    return GameEnum.OK.digest(
+        game=_state_delta(base, state) if base is not None else state,
         role={
             'role_type': role.role_type,
             'skills': role.skills,
@@ -175,58 +224,94 @@ async def info(
             'ishost': game.host_uid == role.uid,
             'speakable': role.speakable,
             'nickname': role.nickname,
-        })
+        },
+        version=version,
+        delta=base is not None)
 
 
-@router.get("/sit", response_model=schema_out.ResponseBase)
-async def sit(
+def _entity_tags(header: Optional[str]) -> List[str]:
+    tags = []
+    for tag in (header or '').split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        tags.append(tag.strip('"'))
+    return tags
+
+
+@router.get("/info", response_model=schema_out.GameInfoOut, response_model_exclude_unset=True)
+async def info(
     *,
-    db: Session = Depends(deps.get_db),
-    current_user: User = Depends(deps.get_current_active_user),
-    position: int
+    response: Response,
+    current_user: Principal = Depends(deps.get_current_active_principal),
+    since: str = None,
+    if_none_match: str = Header(None),
 ):
-    game = db.query(Game).get(current_user.gid)
+    """
+    The ETag is the game version, send it back as If-None-Match to get a 304 while nothing has
+    changed, or as since=<version> to get only the fields and players changed after it.
+    """
+    result = await game_router.call(current_user.gid, _info, current_user.uid, _entity_tags(if_none_match), since)
+    if 'version' in result:
+        etag = f'"{result["version"]}"'
+        if result.get('not_modified'):
+            return Response(status_code=304, headers={'ETag': etag})
+        response.headers['ETag'] = etag
+    return result
+
+
+@command
+def _sit(live: LiveGame, uid: int, position: int):
+    game = live.game
     if game.status is not GameEnum.GAME_STATUS_WAIT_TO_START:
         return GameEnum.GAME_MESSAGE_ALREADY_STARTED.digest()
-    my_role = db.query(Role).get(current_user.uid)
+    my_role = live.role(uid)
+    if my_role is None:
+        return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
     my_role.position = position
-    db.commit()
-    all_players = db.query(Role).filter(Role.gid == game.gid).limit(len(game.players)).all()
-    players = [{'pos': p.position, 'nickname': p.nickname, 'avatar': p.avatar, 'alive': p.alive} for p in all_players]
-    publish_info(game.gid, json.dumps({
-        'game': {
-            'players': players
-        },
-        'mutation': 'SOCKET_GAME'
-    }))
+    game.seat(live.roles.values())
+    game.invalidate_snapshot()
+    game_store.save(live, now=True)
+    players = [{'pos': p.position, 'nickname': p.nickname, 'avatar': p.avatar, 'alive': p.alive} for p in live.roles.values()]
+    publish_game(game.gid, {
+        'players': players
+    })
     return GameEnum.OK.digest()
 
 
-@router.get("/next_step", response_model=schema_out.ResponseBase)
-async def next_step(
+@router.get("/sit", response_model=schema_out.ResponseBase)
+async def sit(
     *,
-    db: Session = Depends(deps.get_db),
-    current_user: User = Depends(deps.get_current_active_user),
+    current_user: Principal = Depends(deps.get_current_active_principal),
+    position: int
 ):
-    game = db.query(Game).with_for_update().get(current_user.gid)
+    return await game_router.call(current_user.gid, _sit, current_user.uid, position)
+
+
+@command
+def _next_step(live: LiveGame, uid: int):
+    game = live.game
     if game.status not in [GameEnum.GAME_STATUS_READY, GameEnum.GAME_STATUS_DAY]:
         return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
-    ret = game.move_on(db)
-    db.commit()
+    ret = live.transition(Engine.move_on)
+    game_store.save(live)
     return ret
 
 
-@router.get("/vote", response_model=schema_out.ResponseBase)
-async def vote(
+@router.get("/next_step", response_model=schema_out.ResponseBase)
+async def next_step(
     *,
-    db: Session = Depends(deps.get_db),
-    current_user: User = Depends(deps.get_current_active_user),
-    target: int
+    current_user: Principal = Depends(deps.get_current_active_principal),
 ):
-    my_role = db.query(Role).get(current_user.uid)
-    if not my_role.alive:
+    return await game_router.call(current_user.gid, _next_step, current_user.uid)
+
+
+@command
+def _vote(live: LiveGame, uid: int, target: int):
+    game = live.game
+    my_role = live.role(uid)
+    if my_role is None or not my_role.alive:
         return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
-    game = db.query(Game).with_for_update().get(current_user.gid)
     if not my_role.voteable or my_role.position not in game.history['voter_votee'][0]:
         logging.debug(f"voteable:{my_role.voteable},my position:{my_role.position},voter:{game.history['voter_votee'][0]}")
         return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
@@ -234,15 +319,14 @@ async def vote(
         logging.debug(f"target position:{my_role.position},votee:{game.history['voter_votee'][1]}")
         return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
     if target > 0:
-        target_role = game.get_role_by_pos(db, target)
+        target_role = game.at(target)
         if not target_role or not target_role.alive:
             return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
 
     now = game.current_step()
     if now in [GameEnum.TURN_STEP_VOTE, GameEnum.TURN_STEP_ELECT_VOTE]:
-        game.history['vote_result'][my_role.position] = target
-        game.history.changed()
-        db.commit()
+        game.history['vote_result'][str(my_role.position)] = target
+        game_store.save(live)
         if target > 0:
             return GameEnum.OK.digest(result=f'你投了{target}号玩家')
         else:
@@ -251,9 +335,8 @@ async def vote(
         if target == GameEnum.TARGET_NO_ONE.value:
             return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
         else:
-            game.history['vote_result'][my_role.position] = target
-            game.history.changed()
-            db.commit()
+            game.history['vote_result'][str(my_role.position)] = target
+            game_store.save(live)
             if target > 0:
                 return GameEnum.OK.digest(result=f'你投了{target}号玩家')
             else:
@@ -262,23 +345,27 @@ async def vote(
         return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
 
 
-@router.get("/handover", response_model=schema_out.ResponseBase)
-async def handover(
+@router.get("/vote", response_model=schema_out.ResponseBase)
+async def vote(
     *,
-    db: Session = Depends(deps.get_db),
-    current_user: User = Depends(deps.get_current_active_user),
+    current_user: Principal = Depends(deps.get_current_active_principal),
     target: int
 ):
-    my_role = db.query(Role).get(current_user.uid)
-    if not my_role.alive:
+    return await game_router.call(current_user.gid, _vote, current_user.uid, target)
+
+
+@command
+def _handover(live: LiveGame, uid: int, target: int):
+    game = live.game
+    my_role = live.role(uid)
+    if my_role is None or not my_role.alive:
         logging.info('my_role is not alive')
         return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
     if target == my_role.position:
         return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
-    game = db.query(Game).with_for_update().get(current_user.gid)
     now = game.current_step()
     if now is not GameEnum.TURN_STEP_USE_SKILLS:
-        logging.info(f'wrong now step:{now.label}')
+        logging.info(f'wrong now step:{now}')
         return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
     if str(my_role.position) not in game.history['dying']:
         logging.info(f'not in dying: my position={my_role.position},dying={game.history["dying"]}')
@@ -287,27 +374,31 @@ async def handover(
         logging.info(f'I am not captain, my position={my_role.position},captain pos={game.captain_pos}')
         return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
     if target > 0:
-        target_role = game.get_role_by_pos(db, target)
-        if not target_role.alive:
+        target_role = game.at(target)
+        if not target_role or not target_role.alive:
             logging.info(f'target not alive, target={target}')
             return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
     game.captain_pos = target
-    db.commit()
+    game_store.save(live)
     publish_history(game.gid, f'{my_role.position}号玩家将警徽移交给了{target}号玩家')
     return GameEnum.OK.digest()
 
 
-@router.get("/elect", response_model=schema_out.ResponseBase)
-async def elect(
+@router.get("/handover", response_model=schema_out.ResponseBase)
+async def handover(
     *,
-    db: Session = Depends(deps.get_db),
-    current_user: User = Depends(deps.get_current_active_user),
-    choice: str
+    current_user: Principal = Depends(deps.get_current_active_principal),
+    target: int
 ):
-    my_role = db.query(Role).get(current_user.uid)
-    if not my_role.alive:
+    return await game_router.call(current_user.gid, _handover, current_user.uid, target)
+
+
+@command
+def _elect(live: LiveGame, uid: int, choice: str):
+    game = live.game
+    my_role = live.role(uid)
+    if my_role is None or not my_role.alive or choice not in ['yes', 'no', 'quit']:
         return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
-    game = db.query(Game).with_for_update().get(current_user.gid)
     now = game.current_step()
     if choice in ['yes', 'no'] and now is not GameEnum.TURN_STEP_ELECT:
         return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
@@ -336,41 +427,41 @@ async def elect(
             captain_pos = votee[0]
             game.captain_pos = captain_pos
             publish_history(game.gid, f'仅剩一位警上玩家，{captain_pos}号玩家自动当选警长')
-            ret = game.move_on(db)
-    else:
-        raise ValueError(f'Unknown choice: {choice}')
-    db.commit()
+            ret = live.transition(Engine.move_on)
+    game_store.save(live)
     return ret or GameEnum.OK.digest()
 
 
-@router.get("/wolf_kill", response_model=schema_out.ResponseBase)
-async def wolf_kill(
+@router.get("/elect", response_model=schema_out.ResponseBase)
+async def elect(
     *,
-    db: Session = Depends(deps.get_db),
-    current_user: User = Depends(deps.get_current_active_user),
-    target: int
+    current_user: Principal = Depends(deps.get_current_active_principal),
+    choice: str
 ):
-    my_role = db.query(Role).get(current_user.uid)
-    if not my_role.alive:
+    return await game_router.call(current_user.gid, _elect, current_user.uid, choice)
+
+
+@command
+def _wolf_kill(live: LiveGame, uid: int, target: int):
+    game = live.game
+    my_role = live.role(uid)
+    if my_role is None or not my_role.alive:
         return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
-    game = db.query(Game).with_for_update().get(current_user.gid)
     now = game.current_step()
     history = game.history
     if now != GameEnum.TAG_ATTACKABLE_WOLF or GameEnum.TAG_ATTACKABLE_WOLF not in my_role.tags:
         return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
     if target > 0:
-        target_role = game.get_role_by_pos(db, target)
-        if not target_role.alive:
+        target_role = game.at(target)
+        if not target_role or not target_role.alive:
             return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
     if game.wolf_mode is GameEnum.WOLF_MODE_FIRST:
         history['wolf_kill_decision'] = target
     else:
-        history['wolf_kill'][my_role.position] = target
-        history.changed()
-        all_players = Role.query.filter(Role.gid == game.gid, Role.alive == int(True)).limit(len(game.players)).all()
+        history['wolf_kill'][str(my_role.position)] = target
         attackable_cnt = 0
-        for p in all_players:
-            if GameEnum.TAG_ATTACKABLE_WOLF in p.tags:
+        for p in live.roles.values():
+            if p.alive and GameEnum.TAG_ATTACKABLE_WOLF in p.tags:
                 attackable_cnt += 1
         if attackable_cnt == len(history['wolf_kill']):
             decision = set(history['wolf_kill'].values())
@@ -378,52 +469,60 @@ async def wolf_kill(
                 history['wolf_kill_decision'] = decision.pop()
             else:
                 history['wolf_kill_decision'] = GameEnum.TARGET_NO_ONE.value
-    game.move_on(db)
-    db.commit()
+    live.transition(Engine.move_on)
+    game_store.save(live)
     if target > 0:
         return GameEnum.OK.digest(result=f'你选择了击杀{target}号玩家')
     else:
         return GameEnum.OK.digest(result=f'你选择空刀')
 
 
-@router.get("/discover", response_model=schema_out.ResponseBase)
-async def discover(
+@router.get("/wolf_kill", response_model=schema_out.ResponseBase)
+async def wolf_kill(
     *,
-    db: Session = Depends(deps.get_db),
-    current_user: User = Depends(deps.get_current_active_user),
+    current_user: Principal = Depends(deps.get_current_active_principal),
     target: int
 ):
-    my_role = db.query(Role).get(current_user.uid)
-    if not my_role.alive:
+    return await game_router.call(current_user.gid, _wolf_kill, current_user.uid, target)
+
+
+@command
+def _discover(live: LiveGame, uid: int, target: int):
+    game = live.game
+    my_role = live.role(uid)
+    if my_role is None or not my_role.alive:
         return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
-    game = db.query(Game).with_for_update().get(current_user.gid)
     now = game.current_step()
     history = game.history
     if now is not GameEnum.ROLE_TYPE_SEER or my_role.role_type is not GameEnum.ROLE_TYPE_SEER:
         return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
     if history['discover'] != GameEnum.TARGET_NOT_ACTED.value:
         return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
-    if target > 0:
-        target_role = game.get_role_by_pos(db, target)
-        if not target_role.alive:
-            return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
+    target_role = game.at(target)
+    if not target_role or not target_role.alive:
+        return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
     history['discover'] = target
     group_result = '<span style="color:red">狼人</span>' if target_role.group_type is GameEnum.GROUP_TYPE_WOLVES else '<span style="color:green">好人</span>'  # noqa E501
-    game.move_on(db)
-    db.commit()
+    live.transition(Engine.move_on)
+    game_store.save(live)
     return GameEnum.OK.digest(result=f'你查验了{target}号玩家为：{group_result}')
 
 
-@router.get("/witch", response_model=schema_out.ResponseBase)
-async def witch(
+@router.get("/discover", response_model=schema_out.ResponseBase)
+async def discover(
     *,
-    db: Session = Depends(deps.get_db),
-    current_user: User = Depends(deps.get_current_active_user),
+    current_user: Principal = Depends(deps.get_current_active_principal),
+    target: int
 ):
-    my_role = db.query(Role).get(current_user.uid)
-    if not my_role.alive:
+    return await game_router.call(current_user.gid, _discover, current_user.uid, target)
+
+
+@command
+def _witch(live: LiveGame, uid: int):
+    game = live.game
+    my_role = live.role(uid)
+    if my_role is None or not my_role.alive:
         return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
-    game = db.query(Game).with_for_update().get(current_user.gid)
     now = game.current_step()
     history = game.history
     if now is not GameEnum.ROLE_TYPE_WITCH or my_role.role_type is not GameEnum.ROLE_TYPE_WITCH:
@@ -435,16 +534,20 @@ async def witch(
         return GameEnum.OK.digest(result=history['wolf_kill_decision'])
 
 
-@router.get("/elixir", response_model=schema_out.ResponseBase)
-async def elixir(
+@router.get("/witch", response_model=schema_out.ResponseBase)
+async def witch(
     *,
-    db: Session = Depends(deps.get_db),
-    current_user: User = Depends(deps.get_current_active_user),
+    current_user: Principal = Depends(deps.get_current_active_principal),
 ):
-    my_role = db.query(Role).get(current_user.uid)
-    if not my_role.alive:
+    return await game_router.call(current_user.gid, _witch, current_user.uid)
+
+
+@command
+def _elixir(live: LiveGame, uid: int):
+    game = live.game
+    my_role = live.role(uid)
+    if my_role is None or not my_role.alive:
         return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
-    game = db.query(Game).with_for_update().get(current_user.gid)
     now = game.current_step()
     history = game.history
     if now is not GameEnum.ROLE_TYPE_WITCH or my_role.role_type is not GameEnum.ROLE_TYPE_WITCH:
@@ -463,24 +566,27 @@ async def elixir(
 
     history['elixir'] = True
     my_role.args['elixir'] = False
-    game.move_on(db)
-    db.commit()
+    live.transition(Engine.move_on)
+    game_store.save(live)
     return GameEnum.OK.digest(result=f'你使用了解药')
 
 
-@router.get("/toxic", response_model=schema_out.ResponseBase)
-async def toxic(
+@router.get("/elixir", response_model=schema_out.ResponseBase)
+async def elixir(
     *,
-    db: Session = Depends(deps.get_db),
-    current_user: User = Depends(deps.get_current_active_user),
-    target: int
+    current_user: Principal = Depends(deps.get_current_active_principal),
 ):
-    my_role = db.query(Role).get(current_user.uid)
-    if not my_role.alive:
+    return await game_router.call(current_user.gid, _elixir, current_user.uid)
+
+
+@command
+def _toxic(live: LiveGame, uid: int, target: int):
+    game = live.game
+    my_role = live.role(uid)
+    if my_role is None or not my_role.alive:
         return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
     if target == my_role.position:
         return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
-    game = db.query(Game).with_for_update().get(current_user.gid)
     now = game.current_step()
     history = game.history
 
@@ -491,31 +597,35 @@ async def toxic(
     if history['elixir'] or history['toxic'] != GameEnum.TARGET_NOT_ACTED.value:
         return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
     if target > 0:
-        target_role = game.get_role_by_pos(db, target)
-        if not target_role.alive:
+        target_role = game.at(target)
+        if not target_role or not target_role.alive:
             return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
     history['toxic'] = target
     if target > 0:
         my_role.args['toxic'] = False
-    game.move_on(db)
-    db.commit()
+    live.transition(Engine.move_on)
+    game_store.save(live)
     if target > 0:
         return GameEnum.OK.digest(result=f'你毒杀了{target}号玩家')
     else:
         return GameEnum.OK.digest()
 
 
-@router.get("/guard", response_model=schema_out.ResponseBase)
-async def guard(
+@router.get("/toxic", response_model=schema_out.ResponseBase)
+async def toxic(
     *,
-    db: Session = Depends(deps.get_db),
-    current_user: User = Depends(deps.get_current_active_user),
+    current_user: Principal = Depends(deps.get_current_active_principal),
     target: int
 ):
-    my_role = db.query(Role).get(current_user.uid)
-    if not my_role.alive:
+    return await game_router.call(current_user.gid, _toxic, current_user.uid, target)
+
+
+@command
+def _guard(live: LiveGame, uid: int, target: int):
+    game = live.game
+    my_role = live.role(uid)
+    if my_role is None or not my_role.alive:
         return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
-    game = db.query(Game).with_for_update().get(current_user.gid)
     now = game.current_step()
     history = game.history
 
@@ -526,32 +636,36 @@ async def guard(
     if history['guard'] != GameEnum.TARGET_NOT_ACTED.value:
         return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
     if target > 0:
-        target_role = game.get_role_by_pos(db, target)
-        if not target_role.alive:
+        target_role = game.at(target)
+        if not target_role or not target_role.alive:
             return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
     history['guard'] = target
     my_role.args['guard'] = target
-    game.move_on(db)
-    db.commit()
+    live.transition(Engine.move_on)
+    game_store.save(live)
     if target > 0:
         return GameEnum.OK.digest(result=f'你守护了{target}号玩家')
     else:
         return GameEnum.OK.digest(result=f'你选择空守')
 
 
-@router.get("/shoot", response_model=schema_out.ResponseBase)
-async def shoot(
+@router.get("/guard", response_model=schema_out.ResponseBase)
+async def guard(
     *,
-    db: Session = Depends(deps.get_db),
-    current_user: User = Depends(deps.get_current_active_user),
+    current_user: Principal = Depends(deps.get_current_active_principal),
     target: int
 ):
-    my_role = db.query(Role).get(current_user.uid)
-    if not my_role.alive:
+    return await game_router.call(current_user.gid, _guard, current_user.uid, target)
+
+
+@command
+def _shoot(live: LiveGame, uid: int, target: int):
+    game = live.game
+    my_role = live.role(uid)
+    if my_role is None or not my_role.alive:
         return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
     if target == my_role.position:
         return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
-    game = db.query(Game).with_for_update().get(current_user.gid)
     now = game.current_step()
 
     if now is not GameEnum.TURN_STEP_USE_SKILLS:
@@ -559,26 +673,31 @@ async def shoot(
     if not my_role.args['shootable'] or str(my_role.position) not in game.history['dying']:
         return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
     if target > 0:
-        target_role = game.get_role_by_pos(db, target)
-        if not target_role.alive or str(target) in game.history['dying']:
+        target_role = game.at(target)
+        if not target_role or not target_role.alive or str(target) in game.history['dying']:
             return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
         my_role.args['shootable'] = False
     publish_history(game.gid, f'{my_role.position}号玩家发动技能“枪击”，击倒了{target}号玩家')
-    game._kill(db, target, GameEnum.SKILL_SHOOT)
-    db.commit()
+    live.transition(Engine.kill, target, GameEnum.SKILL_SHOOT)
+    game_store.save(live)
     return GameEnum.OK.digest()
 
 
-@router.get("/suicide", response_model=schema_out.ResponseBase)
-async def suicide(
+@router.get("/shoot", response_model=schema_out.ResponseBase)
+async def shoot(
     *,
-    db: Session = Depends(deps.get_db),
-    current_user: User = Depends(deps.get_current_active_user),
+    current_user: Principal = Depends(deps.get_current_active_principal),
+    target: int
 ):
-    my_role = db.query(Role).get(current_user.uid)
-    if not my_role.alive:
+    return await game_router.call(current_user.gid, _shoot, current_user.uid, target)
+
+
+@command
+def _suicide(live: LiveGame, uid: int):
+    game = live.game
+    my_role = live.role(uid)
+    if my_role is None or not my_role.alive:
         return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
-    game = db.query(Game).with_for_update().get(current_user.gid)
 
     if game.status is not GameEnum.GAME_STATUS_DAY:
         return GameEnum.GAME_MESSAGE_CANNOT_ACT.digest()
@@ -593,10 +712,18 @@ async def suicide(
         game.steps = [GameEnum.TURN_STEP_UNKNOWN, GameEnum.TURN_STEP_USE_SKILLS]
         game.now_index = 0
     publish_history(game.gid, f'{my_role.position}号玩家自爆了')
-    game._kill(db, my_role.position, GameEnum.SKILL_SUICIDE)
+    live.transition(Engine.kill, my_role.position, GameEnum.SKILL_SUICIDE)
     # try:
     # except GameFinished:
     #     pass  # todo game finished, or global except?
-    ret = game.move_on(db)
-    db.commit()
+    ret = live.transition(Engine.move_on)
+    game_store.save(live)
     return ret
+
+
+@router.get("/suicide", response_model=schema_out.ResponseBase)
+async def suicide(
+    *,
+    current_user: Principal = Depends(deps.get_current_active_principal),
+):
+    return await game_router.call(current_user.gid, _suicide, current_user.uid)
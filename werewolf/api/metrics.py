@@ -0,0 +1,20 @@
+from fastapi import APIRouter, Depends
+from starlette.responses import PlainTextResponse
+
+from werewolf.api import deps
+from werewolf.core import metrics
+from werewolf.runtime.contention import contention
+
+router = APIRouter()
+
+
+# for the scraper and operators only, see METRICS_TOKEN
+@router.get("", response_class=PlainTextResponse, dependencies=[Depends(deps.verify_metrics_token)])
+def read_metrics():
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
+
+@router.get("/contention", dependencies=[Depends(deps.verify_metrics_token)])
+def read_contention(limit: int = 10):
+    """The games of this worker whose commands waited the longest for their turn."""
+    return {'games': contention.top(limit)}
@@ -0,0 +1,44 @@
+import time
+from typing import Callable
+
+from fastapi.routing import APIRoute
+from starlette.requests import Request
+from starlette.responses import Response
+
+from werewolf.core.metrics import Counter, Histogram
+from werewolf.core.request_stats import start_request, end_request
+
+REQUEST_SECONDS = Histogram('werewolf_request_seconds', 'Time to handle a request', ['route', 'method'])
+REQUEST_DB_QUERIES = Histogram('werewolf_request_db_queries', 'Database statements run for a request', ['route'],
+                               buckets=(0, 1, 2, 5, 10, 20, 50, 100))
+REQUEST_DB_SECONDS = Histogram('werewolf_request_db_seconds', 'Time a request spent in database statements', ['route'])
+REQUEST_REPEATED_QUERIES = Counter('werewolf_request_repeated_queries_total',
+                                   'Statements run DB_REPEATED_QUERY_THRESHOLD times or more by one request', ['route'])
+
+
+class TimedRoute(APIRoute):
+    """
+    Records the latency and the database statements of every request, labelled by route, and
+    logs statements one request runs over and over.
+    """
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        route = self.path
+
+        async def timed_handler(request: Request) -> Response:
+            token = start_request()
+            start = time.perf_counter()
+            try:
+                return await handler(request)
+            finally:
+                REQUEST_SECONDS.observe(time.perf_counter() - start, route=route, method=request.method)
+                stats = end_request(token)
+                REQUEST_DB_QUERIES.observe(stats.queries, route=route)
+                REQUEST_DB_SECONDS.observe(stats.db_seconds, route=route)
+                repeated = stats.repeated()
+                if repeated:
+                    REQUEST_REPEATED_QUERIES.inc(len(repeated), route=route)
+                stats.report(f'{request.method} {route}')
+
+        return timed_handler
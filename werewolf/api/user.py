@@ -8,11 +8,13 @@ from sqlalchemy.exc import IntegrityError
 from werewolf.schemas import schema_in, schema_out
 from werewolf.models import User, Role
 from werewolf.api import deps
+from werewolf.api.timing import TimedRoute
 # from werewolf.core.config import settings
-from werewolf.core.security import get_password_hash
+from werewolf.core.security import hash_password
+from werewolf.db.executor import run_in_db
 from werewolf.utils.enums import GameEnum
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
 
 # @router.get("/", response_model=List[schemas.User])
@@ -29,18 +31,7 @@ router = APIRouter()
 #     return users
 
 
-@router.post("/create", response_model=schema_out.ResponseBase)
-def create_user(
-    *,
-    db: Session = Depends(deps.get_db),
-    user_in: schema_in.UserCreateIn,
-) -> Any:
-    """
-    Create new user.
-    """
-    new_user = User(**{k: v for k, v in user_in.dict().items() if k != 'password'})
-    new_user.hashed_password = get_password_hash(user_in.password)
-    new_user.gid = -1
+def _save_new_user(db: Session, new_user: User):
     try:
         db.add(new_user)
         db.commit()
@@ -56,6 +47,21 @@ def create_user(
     db.add(new_role)
     db.commit()
 
+
+@router.post("/create", response_model=schema_out.ResponseBase)
+async def create_user(
+    *,
+    db: Session = Depends(deps.get_db),
+    user_in: schema_in.UserCreateIn,
+) -> Any:
+    """
+    Create new user.
+    """
+    new_user = User(**{k: v for k, v in user_in.dict().items() if k != 'password'})
+    new_user.hashed_password = await hash_password(user_in.password)
+    new_user.gid = -1
+    await run_in_db(_save_new_user, db, new_user)
+
     return GameEnum.OK.digest()
 
 
@@ -5,6 +5,11 @@ from typing import List
 from pydantic import BaseSettings, AnyUrl, AnyHttpUrl
 
 
+class LocalUrl(AnyUrl):
+    """Also takes URLs without a host, e.g. sqlite:///werewolf.db and memory:// for local runs."""
+    host_required = False
+
+
 class Settings(BaseSettings):
     # API_V1_STR: str = "/api/v1"
     API_PREFIX: str = "/werewolf/api"
@@ -12,9 +17,62 @@ class Settings(BaseSettings):
     SECRET_KEY: str = secrets.token_urlsafe(32)
     # 60 minutes * 24 hours * 8 days = 8 days
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 8
-    # 60 seconds * 30 minutes
+    # bcrypt cost factor, hashes with another cost are rehashed on login
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 2
+    # hash jobs handed to the process pool at once, further ones queue in the worker
+    PASSWORD_HASH_CONCURRENCY: int = 2
+    # messages sent to Redis in one pipelined batch at most
+    PUBLISH_BATCH_SIZE: int = 100
+    # seconds the publisher waits for more messages before sending, SOCKET_GAME updates to a
+    # channel within one batch go out as a single frame
+    PUBLISH_COALESCE_WINDOW: float = 0.002
+    # messages of the last EVENT_LOG_SIZE per game are kept for EVENT_LOG_TTL seconds so that a
+    # reconnecting client only gets what it missed
+    EVENT_LOG_SIZE: int = 200
+    EVENT_LOG_TTL: int = 60 * 60
+    # messages buffered per WebSocket subscriber, a client falling further behind is handled by
+    # SUBSCRIBER_OVERFLOW_POLICY: drop_oldest, disconnect, or coalesce (drop game state the queue
+    # already has a newer copy of, disconnect if there is none)
+    SUBSCRIBER_QUEUE_SIZE: int = 256
+    SUBSCRIBER_OVERFLOW_POLICY: str = 'coalesce'
+    # seconds, messages waiting longer than this in a subscriber queue are counted as late
+    SUBSCRIBER_LATE_SECONDS: float = 5
+    # verified tokens kept in memory, entries are dropped on join / quit anyway
+    PRINCIPAL_CACHE_SIZE: int = 10000
+    PRINCIPAL_CACHE_TTL: int = 60 * 5
+    # seconds, how often quiet WebSocket clients are checked, any frame from a client counts as a
+    # heartbeat, dead connections are left to the WebSocket ping / pong of the server
+    HEARTBEAT_INTERVAL: int = 20
+    # a client not heard from within HEARTBEAT_TIMEOUT (60 seconds * 30 minutes) is counted as a
+    # zombie, and closed once quiet for WEBSOCKET_IDLE_TIMEOUT
     HEARTBEAT_TIMEOUT: int = 60 * 30
-    # HEARTBEAT_TIMEOUT: int = 5
+    WEBSOCKET_IDLE_TIMEOUT: int = 60 * 30
+    # seconds, a client taking longer than this to accept a message is closed
+    WEBSOCKET_SEND_TIMEOUT: float = 5
+    # live games untouched for 30 minutes are written back and dropped from memory
+    GAME_STATE_IDLE_TIMEOUT: int = 60 * 30
+    # public game snapshots kept per live game, the older ones answer /game/info?since=<version>
+    GAME_INFO_VERSIONS: int = 8
+    # games whose command wait and hold times are kept for /metrics/contention
+    CONTENTION_TRACKED_GAMES: int = 1000
+    # bearer token the scraper and operators send to read /metrics and /metrics/contention, they
+    # are not served while it is unset
+    METRICS_TOKEN: str = ''
+    # a worker owns a game through a Redis lease, other workers forward commands to it
+    GAME_OWNER_TTL: int = 30
+    GAME_FORWARD_TIMEOUT: int = 10
+    # threads running blocking database work, keep it within DB_POOL_SIZE + DB_MAX_OVERFLOW
+    DB_EXECUTOR_WORKERS: int = 15
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    # seconds, MySQL drops connections idle past wait_timeout (8 hours by default)
+    DB_POOL_RECYCLE: int = 60 * 60
+    DB_POOL_TIMEOUT: int = 30
+    # a request running the same statement this often is logged and counted as a likely N+1
+    DB_REPEATED_QUERY_THRESHOLD: int = 3
+    # only connections idle for longer than this are pinged on checkout
+    DB_POOL_PRE_PING_IDLE: int = 60
     # SERVER_NAME: str
     # SERVER_HOST: AnyHttpUrl
     # BACKEND_CORS_ORIGINS is a JSON-formatted list of origins
@@ -45,8 +103,9 @@ class Settings(BaseSettings):
     # POSTGRES_DB: str
     # SQLALCHEMY_DATABASE_URI: Optional[PostgresDsn] = None
 
-    SQLALCHEMY_DATABASE_URI: AnyUrl
-    REDIS_URL: AnyUrl
+    SQLALCHEMY_DATABASE_URI: LocalUrl
+    # memory:// keeps everything in this worker, for local runs and load tests with a single worker
+    REDIS_URL: LocalUrl
 
     # @validator("SQLALCHEMY_DATABASE_URI", pre=True)
     # def assemble_db_connection(cls, v: Optional[str], values: Dict[str, Any]) -> Any:
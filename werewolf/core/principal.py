@@ -0,0 +1,74 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Set, Tuple
+
+from werewolf.core.config import settings
+
+
+class Principal(NamedTuple):
+    uid: int
+    gid: int
+    is_active: bool
+
+
+class PrincipalCache(object):
+    """
+    Bounded LRU of token -> verified principal, so game actions skip the JWT verify and the user query.
+
+    Entries live for PRINCIPAL_CACHE_TTL seconds at most, never past the token expiry, and are dropped
+    as soon as the gid of the user changes (join / quit). A principal read from the database while its
+    user was invalidated is not stored, see generation().
+    """
+
+    def __init__(self, maxsize: int, ttl: int):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: 'OrderedDict[str, Tuple[Principal, float]]' = OrderedDict()
+        self._tokens: Dict[int, Set[str]] = {}  # uid -> cached tokens
+        self._generations: Dict[int, int] = {}  # uid -> invalidations so far
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[Principal]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            principal, expires_at = entry
+            if time.time() >= expires_at:
+                self._remove(token)
+                return None
+            self._entries.move_to_end(token)
+            return principal
+
+    def generation(self, uid: int) -> int:
+        """Taken before reading the user, and handed to put with what was read."""
+        with self._lock:
+            return self._generations.get(uid, 0)
+
+    def put(self, token: str, principal: Principal, token_exp: float, generation: int) -> None:
+        with self._lock:
+            if self._generations.get(principal.uid, 0) != generation:
+                return  # invalidated while it was read, it may be stale already
+            self._remove(token)
+            self._entries[token] = (principal, min(time.time() + self.ttl, token_exp))
+            self._tokens.setdefault(principal.uid, set()).add(token)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, uid: int) -> None:
+        with self._lock:
+            self._generations[uid] = self._generations.get(uid, 0) + 1
+            for token in list(self._tokens.get(uid, ())):
+                self._remove(token)
+
+    def _remove(self, token: str) -> None:
+        entry = self._entries.pop(token, None)
+        if entry is not None:
+            tokens = self._tokens.get(entry[0].uid)
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens[entry[0].uid]
+
+
+principal_cache = PrincipalCache(settings.PRINCIPAL_CACHE_SIZE, settings.PRINCIPAL_CACHE_TTL)
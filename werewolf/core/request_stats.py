@@ -0,0 +1,86 @@
+import contextvars
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+from werewolf.core.config import settings
+
+
+class RequestStats(object):
+    """What one request cost, shared with the db threads and game actors working for it."""
+    __slots__ = ('queries', 'db_seconds', 'shapes')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.shapes: Counter = Counter()  # statement text with its placeholders -> times run
+
+    def record(self, statement: str, seconds: float) -> None:
+        self.queries += 1
+        self.db_seconds += seconds
+        self.shapes[statement] += 1
+
+    def merge(self, other: 'RequestStats') -> None:
+        self.queries += other.queries
+        self.db_seconds += other.db_seconds
+        self.shapes.update(other.shapes)
+
+    def repeated(self, threshold: int = None) -> List[Tuple[str, int]]:
+        """Statements of the same shape run at least `threshold` times, the usual sign of an N+1."""
+        threshold = threshold or settings.DB_REPEATED_QUERY_THRESHOLD
+        # a flush writes each changed row on its own by design, only repeated reads are suspicious
+        return [(statement, n) for statement, n in self.shapes.most_common()
+                if n >= threshold and statement.lstrip().upper().startswith('SELECT')]
+
+    def report(self, name: str) -> None:
+        logging.debug(f'{name}: {self.queries} queries in {self.db_seconds * 1000:.1f}ms')
+        for statement, n in self.repeated():
+            logging.warning(f'{name}: same query run {n} times: {statement[:200]}')
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar('request_stats', default=None)
+
+
+def current_stats() -> Optional[RequestStats]:
+    return _current.get()
+
+
+def start_request() -> contextvars.Token:
+    return _current.set(RequestStats())
+
+
+def end_request(token: contextvars.Token) -> RequestStats:
+    """Ends the stats started with the token, an enclosing one (e.g. assert_max_queries) gets them too."""
+    stats = _current.get()
+    _current.reset(token)
+    outer = _current.get()
+    if outer is not None:
+        outer.merge(stats)
+    return stats
+
+
+@contextmanager
+def assert_max_queries(limit: int, repeated_threshold: int = None) -> Iterator[RequestStats]:
+    """
+    For tests and benchmarks, fails when the block runs more than `limit` statements or the same
+    statement `repeated_threshold` times, e.g.
+
+        with assert_max_queries(3):
+            client.get('/werewolf/api/game/vote', ...)
+
+    Requests handled inside the block count as well, TestClient runs them in the caller's context.
+    """
+    token = start_request()
+    stats = current_stats()
+    try:
+        yield stats
+    finally:
+        end_request(token)
+    problems = []
+    if stats.queries > limit:
+        problems.append(f'{stats.queries} queries, expected at most {limit}')
+    problems.extend(f'same query run {n} times: {statement}' for statement, n in stats.repeated(repeated_threshold))
+    if problems:
+        statements = '\n'.join(f'{n} x {statement}' for statement, n in stats.shapes.most_common())
+        raise AssertionError('; '.join(problems) + '\n' + statements)
@@ -1,12 +1,25 @@
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-from typing import Any, Union
+from typing import Any, Optional, Tuple, Union
 
 from jose import jwt
 from passlib.context import CryptContext
 
 from werewolf.core.config import settings
+from werewolf.core.metrics import Gauge, Histogram
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# hashes with another cost than BCRYPT_ROUNDS need an update, they are rehashed on the next login
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS,
+                           bcrypt__min_rounds=settings.BCRYPT_ROUNDS, bcrypt__max_rounds=settings.BCRYPT_ROUNDS)
+
+PASSWORD_HASH_QUEUED = Gauge('werewolf_password_hash_queued', 'Password hash jobs waiting for a free slot')
+PASSWORD_HASH_RUNNING = Gauge('werewolf_password_hash_running', 'Password hash jobs running in the process pool')
+PASSWORD_HASH_SECONDS = Histogram('werewolf_password_hash_seconds', 'Password hash jobs, queueing included', ['op'])
+
+_hash_pool: Optional[ProcessPoolExecutor] = None
+_hash_slots: Optional[asyncio.Semaphore] = None
 
 
 ALGORITHM = "HS256"
@@ -30,3 +43,48 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
+
+
+def _verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+async def _run_hash_job(op: str, fn, *args):
+    # bcrypt holds a core for the whole hash, so it runs in worker processes and at most
+    # PASSWORD_HASH_CONCURRENCY jobs are in flight, the rest wait here
+    global _hash_pool, _hash_slots
+    if _hash_pool is None:
+        _hash_pool = ProcessPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS)
+        _hash_slots = asyncio.Semaphore(settings.PASSWORD_HASH_CONCURRENCY)
+    start = time.perf_counter()
+    queued = True
+    PASSWORD_HASH_QUEUED.inc()
+    try:
+        async with _hash_slots:
+            PASSWORD_HASH_QUEUED.dec()
+            queued = False
+            PASSWORD_HASH_RUNNING.inc()
+            try:
+                return await asyncio.get_event_loop().run_in_executor(_hash_pool, fn, *args)
+            finally:
+                PASSWORD_HASH_RUNNING.dec()
+    finally:
+        if queued:  # cancelled while waiting
+            PASSWORD_HASH_QUEUED.dec()
+        PASSWORD_HASH_SECONDS.observe(time.perf_counter() - start, op=op)
+
+
+async def hash_password(password: str) -> str:
+    return await _run_hash_job('hash', get_password_hash, password)
+
+
+async def check_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Returns (valid, new_hash), new_hash is set when the stored hash should be replaced.
+    """
+    return await _run_hash_job('verify', _verify_and_update, plain_password, hashed_password)
+
+
+def shutdown_hash_pool() -> None:
+    if _hash_pool is not None:
+        _hash_pool.shutdown(wait=False)
@@ -0,0 +1,16 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable
+
+from werewolf.core.config import settings
+
+# every blocking MySQL round trip runs here, never on the event loop
+db_executor = ThreadPoolExecutor(max_workers=settings.DB_EXECUTOR_WORKERS, thread_name_prefix='db')
+
+
+async def run_in_db(fn: Callable, *args, **kwargs):
+    loop = asyncio.get_event_loop()
+    # in the caller's context, so the statements are counted for its request
+    return await loop.run_in_executor(db_executor, partial(contextvars.copy_context().run, fn, *args, **kwargs))
@@ -1,7 +1,85 @@
-from sqlalchemy import create_engine
+import time
+
+from sqlalchemy import create_engine, event, exc
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 
 from werewolf.core.config import settings
+from werewolf.core.metrics import Counter, Gauge, Histogram
+from werewolf.core.request_stats import current_stats
+
+
+DB_POOL_CHECKOUT_WAIT = Histogram('werewolf_db_pool_checkout_wait_seconds', 'Time spent waiting for a pooled connection')
+DB_QUERIES = Counter('werewolf_db_queries_total', 'Statements sent to the database')
+DB_QUERY_SECONDS = Histogram('werewolf_db_query_seconds', 'Time to run one statement')
+DB_POOL_PINGS = Histogram('werewolf_db_pool_ping_seconds', 'Pings of connections idle past DB_POOL_PRE_PING_IDLE')
+
 
-engine = create_engine(settings.SQLALCHEMY_DATABASE_URI, pool_pre_ping=True)
+class InstrumentedQueuePool(QueuePool):
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start)
+
+
+engine = create_engine(
+    settings.SQLALCHEMY_DATABASE_URI,
+    poolclass=InstrumentedQueuePool,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    # the db executor threads share pooled SQLite connections as well, for local runs and load tests
+    connect_args={'check_same_thread': False} if settings.SQLALCHEMY_DATABASE_URI.startswith('sqlite') else {},
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+Gauge('werewolf_db_pool_in_use', 'Connections checked out of the pool', function=lambda: engine.pool.checkedout())
+Gauge('werewolf_db_pool_idle', 'Connections idle in the pool', function=lambda: engine.pool.checkedin())
+Gauge('werewolf_db_pool_overflow', 'Connections opened beyond DB_POOL_SIZE', function=lambda: max(engine.pool.overflow(), 0))
+
+
+@event.listens_for(engine, 'checkin')
+def _checkin(dbapi_connection, connection_record):
+    connection_record.info['checkin_at'] = time.monotonic()
+
+
+@event.listens_for(engine, 'checkout')
+def _checkout(dbapi_connection, connection_record, connection_proxy):
+    # pool_pre_ping pings on every checkout, only ping connections which sat idle long enough to be dropped
+    checkin_at = connection_record.info.get('checkin_at')
+    if checkin_at is None or time.monotonic() - checkin_at < settings.DB_POOL_PRE_PING_IDLE:
+        return
+    start = time.perf_counter()
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute('SELECT 1')
+    except Exception:
+        # the pool retries the checkout with a fresh connection
+        raise exc.DisconnectionError()
+    finally:
+        cursor.close()
+        DB_POOL_PINGS.observe(time.perf_counter() - start)
+
+
+@event.listens_for(engine, 'before_cursor_execute')
+def _before_query(conn, cursor, statement, parameters, context, executemany):
+    # kept with the statement, so that one which fails and never gets to _after_query leaves nothing behind
+    if context is None:
+        conn.info['query_start'] = time.perf_counter()  # one slot, the next statement overwrites it
+    else:
+        context._query_start = time.perf_counter()
+
+
+@event.listens_for(engine, 'after_cursor_execute')
+def _after_query(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info['query_start'] if context is None else context._query_start
+    elapsed = time.perf_counter() - start
+    DB_QUERIES.inc()
+    DB_QUERY_SECONDS.observe(elapsed)
+    stats = current_stats()
+    if stats is not None:
+        # the statement text keeps its placeholders, so the same query with other values counts as one shape
+        stats.record(statement, elapsed)
@@ -0,0 +1,3 @@
+from .effects import History, Music, GameFields, PlayerOut
+from .state import GameState, RoleState
+from .transitions import Engine
@@ -0,0 +1,12 @@
+"""
+What a transition wants the players to see, returned as data instead of published.
+
+The server hands them to werewolf.websocket.websocket.publish_effects, bots and simulations can
+read or drop them.
+"""
+from collections import namedtuple
+
+History = namedtuple('History', 'message show')
+Music = namedtuple('Music', 'instruction bgm bgm_loop')
+GameFields = namedtuple('GameFields', 'fields')  # a SOCKET_GAME update
+PlayerOut = namedtuple('PlayerOut', 'pos')
@@ -0,0 +1,207 @@
+"""
+Rules that only read or set plain attributes, shared by the engine state and the ORM models.
+
+Games and roles are duck-typed: a GameState / RoleState or a Game / Role row.
+"""
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from werewolf.utils.enums import GameEnum
+
+VOTE_STEPS = (GameEnum.TURN_STEP_VOTE, GameEnum.TURN_STEP_ELECT_VOTE,
+              GameEnum.TURN_STEP_PK_VOTE, GameEnum.TURN_STEP_ELECT_PK_VOTE)
+TALK_STEPS = (GameEnum.TURN_STEP_TALK, GameEnum.TURN_STEP_PK_TALK,
+              GameEnum.TURN_STEP_ELECT_TALK, GameEnum.TURN_STEP_ELECT_PK_TALK)
+
+
+def wolf_mode_by_cards(cards: List[GameEnum]) -> GameEnum:
+    # WOLF_MODE_FIRST if there is no thrid party, else WOLF_MODE_ALL
+    if GameEnum.ROLE_TYPE_CUPID in cards:
+        return GameEnum.WOLF_MODE_ALL
+    else:
+        return GameEnum.WOLF_MODE_FIRST
+
+
+def seats_cnt(cards: List[GameEnum]) -> int:
+    cnt = len(cards)
+    if GameEnum.ROLE_TYPE_THIEF in cards:
+        cnt -= 2
+    return cnt
+
+
+def init_game(game):
+    game.status = GameEnum.GAME_STATUS_WAIT_TO_START
+    game.end_time = datetime.utcnow() + timedelta(days=1)
+    game.days = 0
+    game.now_index = -1
+    game.step_cnt = 0
+    game.steps = []
+    game.history = new_history()
+    game.captain_pos = -1
+    game.players = []
+
+
+def new_history() -> dict:
+    """
+        pos: -1=no one, -2=not acted
+        {
+            'wolf_kill':{wolf_pos:target_pos,...},
+            'wolf_kill_decision':pos,
+            'elixir':True / False,
+            'guard':pos,
+            'toxic':pos,
+            'discover':pos,
+            'voter_votee':[[voter_pos,...],[votee_pos,...]],
+            'vote_result': {voter_pos:votee_pos,...},
+            'dying':{pos:True},
+        }
+    """
+    return {
+        'wolf_kill': {},
+        'wolf_kill_decision': GameEnum.TARGET_NOT_ACTED.value,
+        'elixir': False,
+        'guard': GameEnum.TARGET_NOT_ACTED.value,
+        'toxic': GameEnum.TARGET_NOT_ACTED.value,
+        'discover': GameEnum.TARGET_NOT_ACTED.value,
+        'voter_votee': [[], []],
+        'vote_result': {},
+        'dying': {},
+    }
+
+
+def copy_history(history: dict) -> dict:
+    # one level deeper than dict.copy(), enough for the shape above
+    copied = {}
+    for k, v in history.items():
+        if isinstance(v, dict):
+            v = dict(v)
+        elif isinstance(v, list):
+            v = [list(i) if isinstance(i, list) else i for i in v]
+        copied[k] = v
+    return copied
+
+
+def current_step(steps: List[GameEnum], now_index: int) -> Optional[GameEnum]:
+    if now_index < 0 or now_index >= len(steps):
+        return None
+    else:
+        return steps[now_index]
+
+
+def init_steps(days: int, cards: List[GameEnum], captain_mode: GameEnum) -> List[GameEnum]:
+    steps = [GameEnum.TURN_STEP_TURN_NIGHT]
+    if days == 1 and GameEnum.ROLE_TYPE_THIEF in cards:
+        pass  # todo
+    if days == 1 and GameEnum.ROLE_TYPE_CUPID in cards:
+        pass  # todo
+    # TODO: 恋人互相确认身份
+    steps.append(GameEnum.TAG_ATTACKABLE_WOLF)
+    if GameEnum.ROLE_TYPE_SEER in cards:
+        steps.append(GameEnum.ROLE_TYPE_SEER)
+    if GameEnum.ROLE_TYPE_WITCH in cards:
+        steps.append(GameEnum.ROLE_TYPE_WITCH)
+    if GameEnum.ROLE_TYPE_SAVIOR in cards:
+        steps.append(GameEnum.ROLE_TYPE_SAVIOR)
+    steps.append(GameEnum.TURN_STEP_TURN_DAY)
+    if days == 1 and captain_mode is GameEnum.CAPTAIN_MODE_WITH_CAPTAIN:
+        steps.append(GameEnum.TURN_STEP_ELECT)
+        steps.append(GameEnum.TURN_STEP_ELECT_TALK)
+        steps.append(GameEnum.TURN_STEP_ELECT_VOTE)
+    steps.append(GameEnum.TURN_STEP_ANNOUNCE)
+    steps.append(GameEnum.TURN_STEP_USE_SKILLS)
+    if days == 1:
+        steps.append(GameEnum.TURN_STEP_LAST_WORDS)
+    steps.append(GameEnum.TURN_STEP_TALK)
+    steps.append(GameEnum.TURN_STEP_VOTE)
+    steps.append(GameEnum.TURN_STEP_USE_SKILLS)
+    steps.append(GameEnum.TURN_STEP_LAST_WORDS)
+    return steps
+
+
+def instruction_string(steps: List[GameEnum], now_index: int) -> str:
+    now = current_step(steps, now_index)
+    if now in TALK_STEPS:
+        return '结束发言'
+
+    if now is GameEnum.TURN_STEP_LAST_WORDS:
+        return '结束遗言'
+
+    if now in VOTE_STEPS:
+        return '结束投票'
+
+    if now is GameEnum.TURN_STEP_ELECT:
+        return '结束上警'
+
+    if now is GameEnum.TURN_STEP_USE_SKILLS:
+        return '技能使用完毕'
+
+    next_index = now_index + 1
+    if next_index >= len(steps):
+        step = GameEnum.TURN_STEP_TURN_NIGHT
+    else:
+        step = steps[next_index]
+
+    if step is GameEnum.TURN_STEP_TURN_NIGHT:
+        return '入夜'
+
+    return ''
+
+
+def reset_role(role):
+    role.role_type = GameEnum.ROLE_TYPE_UNKNOWN
+    role.group_type = GameEnum.GROUP_TYPE_UNKNOWN
+    role.alive = True
+    # role.iscaptain = False
+    role.voteable = True
+    role.speakable = True
+    role.position = -1
+    role.skills = []
+    role.tags = []
+    role.args = {}
+
+
+def prepare_role(role, captain_mode: GameEnum):
+    if role.role_type is GameEnum.ROLE_TYPE_SEER:
+        role.group_type = GameEnum.GROUP_TYPE_GODS
+    elif role.role_type is GameEnum.ROLE_TYPE_WITCH:
+        role.args = {'elixir': True, 'toxic': True}
+        role.group_type = GameEnum.GROUP_TYPE_GODS
+    elif role.role_type is GameEnum.ROLE_TYPE_HUNTER:
+        role.args = {'shootable': True}
+        role.group_type = GameEnum.GROUP_TYPE_GODS
+    elif role.role_type is GameEnum.ROLE_TYPE_SAVIOR:
+        role.args = {'guard': GameEnum.TARGET_NO_ONE.value}
+        role.group_type = GameEnum.GROUP_TYPE_GODS
+    elif role.role_type is GameEnum.ROLE_TYPE_VILLAGER:
+        role.group_type = GameEnum.GROUP_TYPE_VILLAGERS
+    elif role.role_type is GameEnum.ROLE_TYPE_NORMAL_WOLF:
+        role.group_type = GameEnum.GROUP_TYPE_WOLVES
+        role.tags.append(GameEnum.TAG_ATTACKABLE_WOLF)
+    elif role.role_type is GameEnum.ROLE_TYPE_IDIOT:
+        role.args = {'exposed': False}
+        role.group_type = GameEnum.GROUP_TYPE_GODS
+    else:
+        raise TypeError(f'Cannot prepare for role type {role.role_type}')
+
+    # prepare for skills
+    if role.role_type is GameEnum.ROLE_TYPE_UNKNOWN:
+        role.skills = []
+        return
+
+    skills = [GameEnum.SKILL_VOTE]
+    if captain_mode is GameEnum.CAPTAIN_MODE_WITH_CAPTAIN:
+        skills.append(GameEnum.SKILL_CAPTAIN)
+
+    if role.role_type is GameEnum.ROLE_TYPE_SEER:
+        skills.append(GameEnum.SKILL_DISCOVER)
+    if role.role_type is GameEnum.ROLE_TYPE_WITCH:
+        skills.append(GameEnum.SKILL_WITCH)
+    if role.role_type is GameEnum.ROLE_TYPE_HUNTER:
+        skills.append(GameEnum.SKILL_SHOOT)
+    if role.role_type is GameEnum.ROLE_TYPE_SAVIOR:
+        skills.append(GameEnum.SKILL_GUARD)
+    if GameEnum.TAG_ATTACKABLE_WOLF in role.tags:
+        skills.append(GameEnum.SKILL_WOLF_KILL)
+        skills.append(GameEnum.SKILL_SUICIDE)
+
+    role.skills = skills
@@ -0,0 +1,122 @@
+from typing import Dict, Iterable, List, Optional
+
+from werewolf.utils.enums import GameEnum
+from . import rules
+
+# the columns a game / role row is written back from, see Game.apply_state and Role.apply_state
+GAME_FIELDS = ('gid', 'host_uid', 'status', 'victory_mode', 'captain_mode', 'witch_mode', 'wolf_mode', 'end_time', 'players',
+               'cards', 'days', 'now_index', 'step_cnt', 'steps', 'history', 'captain_pos')
+ROLE_FIELDS = ('uid', 'nickname', 'avatar', 'position', 'role_type', 'group_type', 'alive', 'voteable', 'speakable', 'skills',
+               'tags', 'args')
+
+
+class RoleState(object):
+    __slots__ = ROLE_FIELDS
+
+    def __init__(self, uid: int, position: int = -1, nickname: str = '', avatar: int = 0):
+        rules.reset_role(self)
+        self.uid = uid
+        self.nickname = nickname
+        self.avatar = avatar
+        self.position = position
+
+    def reset(self):
+        rules.reset_role(self)
+
+    def prepare(self, captain_mode: GameEnum):
+        rules.prepare_role(self, captain_mode)
+
+    def copy(self) -> 'RoleState':
+        role = RoleState.__new__(RoleState)
+        role.uid = self.uid
+        role.nickname = self.nickname
+        role.avatar = self.avatar
+        role.position = self.position
+        role.role_type = self.role_type
+        role.group_type = self.group_type
+        role.alive = self.alive
+        role.voteable = self.voteable
+        role.speakable = self.speakable
+        role.skills = list(self.skills)
+        role.tags = list(self.tags)
+        role.args = dict(self.args)
+        return role
+
+
+class GameState(object):
+    """
+    A game and its roles as plain objects, no session and no publishing.
+
+    This is what a worker holds for a live game and what the engine runs on, the rows are only
+    written from it on persist. Bots and simulations build one by hand, e.g. with deal().
+    """
+    # snapshot_serial is bumped whenever the state every player sees changes
+    __slots__ = GAME_FIELDS + ('snapshot_serial', 'roles', 'by_pos')
+
+    def __init__(self, cards: List[GameEnum], roles: Iterable[RoleState] = (), *, gid: int = 0, host_uid: int = 0,
+                 victory_mode: GameEnum = GameEnum.VICTORY_MODE_KILL_GROUP,
+                 captain_mode: GameEnum = GameEnum.CAPTAIN_MODE_WITH_CAPTAIN,
+                 witch_mode: GameEnum = GameEnum.WITCH_MODE_CAN_SAVE_SELF):
+        self.gid = gid
+        self.host_uid = host_uid
+        self.victory_mode = victory_mode
+        self.captain_mode = captain_mode
+        self.witch_mode = witch_mode
+        self.wolf_mode = rules.wolf_mode_by_cards(cards)
+        self.cards = list(cards)
+        self.snapshot_serial = 0
+        rules.init_game(self)
+        self.seat(roles)
+
+    @classmethod
+    def deal(cls, cards: List[GameEnum], **modes) -> 'GameState':
+        """A game ready to start, the cards dealt in order to seats 1..n (shuffle them first for a random deal)."""
+        roles = []
+        for pos, card in enumerate(cards, 1):
+            role = RoleState(uid=pos, position=pos)
+            role.role_type = card
+            roles.append(role)
+        state = cls(cards, roles, **modes)
+        for role in roles:
+            role.prepare(state.captain_mode)
+        state.players = [r.uid for r in roles]
+        state.status = GameEnum.GAME_STATUS_READY
+        return state
+
+    def init_game(self):
+        rules.init_game(self)
+
+    def invalidate_snapshot(self):
+        self.snapshot_serial += 1
+
+    def seat(self, roles: Iterable[RoleState]):
+        """Takes the roles again, after one joined, left or changed seats."""
+        self.roles: List[RoleState] = sorted(roles, key=lambda r: r.position)
+        self.by_pos: Dict[int, RoleState] = {r.position: r for r in self.roles if r.position > 0}
+
+    def copy(self) -> 'GameState':
+        state = GameState.__new__(GameState)
+        for f in GAME_FIELDS:
+            setattr(state, f, getattr(self, f))
+        state.snapshot_serial = self.snapshot_serial
+        state.players = list(self.players)
+        state.cards = list(self.cards)
+        state.steps = list(self.steps)
+        state.history = rules.copy_history(self.history)
+        state.seat([r.copy() for r in self.roles])
+        return state
+
+    def current_step(self) -> Optional[GameEnum]:
+        return rules.current_step(self.steps, self.now_index)
+
+    def get_seats_cnt(self) -> int:
+        return rules.seats_cnt(self.cards)
+
+    def get_instruction_string(self) -> str:
+        return rules.instruction_string(self.steps, self.now_index)
+
+    def at(self, pos: int) -> Optional[RoleState]:
+        return self.by_pos.get(pos)
+
+    def alive(self) -> List[RoleState]:
+        return [r for r in self.roles if r.alive]
@@ -0,0 +1,345 @@
+import collections
+import logging
+from typing import List
+
+from werewolf.utils.enums import GameEnum
+from werewolf.utils.game_exceptions import GameFinished
+from . import rules
+from .effects import History, Music, GameFields, PlayerOut
+from .state import GameState
+
+# looked up once, GameEnum.X.value goes through the enum descriptors every time
+OK = GameEnum.OK.value
+NO_TARGET = (GameEnum.TARGET_NOT_ACTED.value, GameEnum.TARGET_NO_ONE.value)
+
+
+class Engine(object):
+    """
+    The step machine of a game, run on a GameState.
+
+    Transitions change the state in place and append what the players should see to `effects`,
+    nothing is published or written here. A finished game raises GameFinished as before, the
+    effects up to that point are kept.
+    """
+    __slots__ = ('state', 'effects')
+
+    def __init__(self, state: GameState, effects: List = None):
+        self.state = state
+        self.effects = [] if effects is None else effects
+
+    def move_on(self) -> dict:
+        state = self.state
+        state.invalidate_snapshot()
+        step_flag = GameEnum.STEP_FLAG_AUTO_MOVE_ON
+        while step_flag is GameEnum.STEP_FLAG_AUTO_MOVE_ON:
+            leave_result = self.leave_step()
+            if leave_result['code'] != OK:
+                return leave_result
+
+            state.step_cnt += 1
+            state.now_index += 1
+            if state.now_index >= len(state.steps):
+                state.now_index = 0
+                state.days += 1
+                state.steps = rules.init_steps(state.days, state.cards, state.captain_mode)
+
+            step_flag = self.enter_step()
+        instruction_string = rules.instruction_string(state.steps, state.now_index)
+        if instruction_string:
+            self.effects.append(GameFields({
+                'next_step': instruction_string
+            }))
+        self.effects.append(GameFields({
+            'status': state.current_step().value
+        }))
+        return GameEnum.OK.digest()
+
+    def _drop_next(self, steps):
+        state = self.state
+        while state.now_index + 1 < len(state.steps) and state.steps[state.now_index + 1] in steps:
+            state.steps.pop(state.now_index + 1)
+
+    def leave_step(self) -> dict:
+        state = self.state
+        history = state.history
+        now = state.current_step()
+        if now is None:
+            return GameEnum.OK.digest()
+        if now is GameEnum.TURN_STEP_ELECT:
+            for r in state.roles:
+                if GameEnum.TAG_ELECT not in r.tags and GameEnum.TAG_NOT_ELECT not in r.tags:
+                    r.tags.append(GameEnum.TAG_NOT_ELECT)
+
+            voters = []
+            votees = []
+            for r in state.roles:
+                if not r.alive:
+                    continue
+                if GameEnum.TAG_ELECT in r.tags:
+                    votees.append(r.position)
+                else:
+                    voters.append(r.position)
+            voters.sort()
+            votees.sort()
+
+            if not voters or not votees:
+                # no captain
+                self._drop_next((GameEnum.TURN_STEP_ELECT_TALK, GameEnum.TURN_STEP_ELECT_VOTE))
+                if not voters:
+                    self.effects.append(History('所有人都竞选警长，本局游戏无警长', True))
+                else:
+                    self.effects.append(History('没有人竞选警长，本局游戏无警长', True))
+            elif len(votees) == 1:
+                # auto win captain
+                self._drop_next((GameEnum.TURN_STEP_ELECT_TALK, GameEnum.TURN_STEP_ELECT_VOTE))
+                captain_pos = votees[0]
+                state.captain_pos = captain_pos
+                self.effects.append(History(f'只有{captain_pos}号玩家竞选警长，自动当选', True))
+            else:
+                msg = f"竞选警长的玩家为：{','.join(map(str,votees))}\n未竞选警长的玩家为：{','.join(map(str,voters))}"  # noqa E501
+                self.effects.append(History(msg, True))
+                history['voter_votee'] = [voters, votees]
+            return GameEnum.OK.digest()
+        elif now in rules.VOTE_STEPS:
+            return self._tally(now)
+        elif now is GameEnum.TAG_ATTACKABLE_WOLF:
+            self.effects.append(Music('wolf_end_voice', None, False))
+        elif now is GameEnum.ROLE_TYPE_SEER:
+            self.effects.append(Music('seer_end_voice', None, False))
+        elif now is GameEnum.ROLE_TYPE_WITCH:
+            self.effects.append(Music('witch_end_voice', None, False))
+        elif now is GameEnum.ROLE_TYPE_SAVIOR:
+            self.effects.append(Music('savior_end_voice', None, False))
+        elif now is GameEnum.TURN_STEP_USE_SKILLS:
+            for d in history['dying']:
+                role = state.at(int(d))
+                role.alive = False
+                self.effects.append(PlayerOut(role.position))
+            history['dying'] = {}
+        return GameEnum.OK.digest()
+
+    def _tally(self, now: GameEnum) -> dict:
+        state = self.state
+        history = state.history
+        msg = ""
+        announce_result = collections.defaultdict(list)
+        ticket_cnt = collections.defaultdict(int)
+        forfeit = []
+        most_voted = []
+        max_ticket = 0
+        for voter_pos, votee_pos in history['vote_result'].items():
+            voter_pos = int(voter_pos)
+            votee_pos = int(votee_pos)
+            if votee_pos in NO_TARGET:
+                forfeit.append(voter_pos)
+                continue
+            announce_result[votee_pos].append(voter_pos)
+            ticket_cnt[votee_pos] += 1
+            if voter_pos == state.captain_pos:
+                ticket_cnt[votee_pos] += 0.5
+        for voter in history['voter_votee'][0]:
+            if str(voter) not in history['vote_result']:
+                forfeit.append(voter)
+        forfeit.sort()
+        if forfeit and now in [GameEnum.TURN_STEP_PK_VOTE, GameEnum.TURN_STEP_ELECT_PK_VOTE]:
+            return GameEnum.GAME_MESSAGE_NOT_VOTED_YET.digest(*forfeit)
+        for votee, voters in sorted(announce_result.items()):
+            msg += '{} <= {}\n'.format(votee, ','.join(map(str, voters)))
+        if forfeit:
+            msg += '弃票：{}\n'.format(','.join(map(str, forfeit)))
+
+        if not ticket_cnt:
+            most_voted = history['voter_votee'][1]
+        else:
+            ticket_cnt = sorted(ticket_cnt.items(), key=lambda x: x[1], reverse=True)
+            most_voted.append(ticket_cnt[0][0])
+            max_ticket = ticket_cnt[0][1]
+            for votee, ticket in ticket_cnt[1:]:
+                if ticket == max_ticket:
+                    most_voted.append(votee)
+                else:
+                    break
+        most_voted.sort()
+
+        if len(most_voted) == 1:
+            if now in [GameEnum.TURN_STEP_VOTE, GameEnum.TURN_STEP_PK_VOTE]:
+                msg += f'{most_voted[0]}号玩家以{max_ticket}票被公投出局'
+                self.effects.append(History(msg, True))
+                self.kill(most_voted[0], GameEnum.SKILL_VOTE)
+            else:
+                state.captain_pos = most_voted[0]
+                msg += f'{most_voted[0]}号玩家以{max_ticket}票当选警长'
+                self.effects.append(History(msg, True))
+            return GameEnum.OK.digest()
+        # 平票
+        if now in [GameEnum.TURN_STEP_VOTE, GameEnum.TURN_STEP_ELECT_VOTE]:  # todo 全体进入PK
+            if now is GameEnum.TURN_STEP_VOTE:
+                state.steps.insert(state.now_index + 1, GameEnum.TURN_STEP_PK_TALK)
+                state.steps.insert(state.now_index + 2, GameEnum.TURN_STEP_PK_VOTE)
+            else:
+                state.steps.insert(state.now_index + 1, GameEnum.TURN_STEP_ELECT_PK_TALK)
+                state.steps.insert(state.now_index + 2, GameEnum.TURN_STEP_ELECT_PK_VOTE)
+            votees = most_voted
+            voters = []
+            for r in state.alive():
+                if r.voteable and r.position not in votees:
+                    voters.append(r.position)
+            history['voter_votee'] = [voters, votees]
+            msg += '以下玩家以{}票平票进入PK：{}'.format(max_ticket, ','.join(map(str, votees)))
+            self.effects.append(History(msg, True))
+            return GameEnum.OK.digest()
+        msg += '以下玩家以{}票再次平票：{}\n'.format(max_ticket, ','.join(map(str, most_voted)))
+        if now is GameEnum.TURN_STEP_PK_VOTE:
+            msg += '今日无人被公投出局'
+            self._drop_next((GameEnum.TURN_STEP_LAST_WORDS,))
+        else:
+            msg += '警徽流失，本局游戏无警长'
+        self.effects.append(History(msg, True))
+        return GameEnum.OK.digest()
+
+    def enter_step(self) -> GameEnum:
+        state = self.state
+        now = state.current_step()
+        if now is GameEnum.TURN_STEP_TURN_NIGHT:
+            state.status = GameEnum.GAME_STATUS_NIGHT
+            state.history = rules.new_history()
+            self.effects.append(Music('night_start_voice', 'night_bgm', True))
+            self.effects.append(GameFields({
+                'days': state.days,
+            }))
+            self.effects.append(History(
+                (
+                    '***************************\n'
+                    '<pre>         第{}天           </pre>\n'
+                    '***************************'
+                ).format(state.days), False))
+            return GameEnum.STEP_FLAG_AUTO_MOVE_ON
+        elif now is GameEnum.TAG_ATTACKABLE_WOLF:
+            self.effects.append(Music('wolf_start_voice', 'wolf_bgm', True))
+            # todo: move on after a random timeout when no wolf can attack
+            return GameEnum.STEP_FLAG_WAIT_FOR_ACTION
+        elif now in [GameEnum.TURN_STEP_TALK, GameEnum.TURN_STEP_ELECT_TALK]:
+            return GameEnum.STEP_FLAG_WAIT_FOR_ACTION
+        elif now is GameEnum.TURN_STEP_ELECT:
+            self.effects.append(Music('elect', None, False))
+            self.effects.append(History('###上警阶段###', False))
+            return GameEnum.STEP_FLAG_WAIT_FOR_ACTION
+        elif now is GameEnum.TURN_STEP_VOTE:
+            state.history['vote_result'] = {}
+            voters = []
+            votees = []
+            for r in state.alive():
+                votees.append(r.position)
+                if r.voteable:
+                    voters.append(r.position)
+            state.history['voter_votee'] = [voters, votees]
+            self.effects.append(History('###投票阶段###', False))
+            return GameEnum.STEP_FLAG_WAIT_FOR_ACTION
+        elif now is GameEnum.TURN_STEP_ELECT_VOTE:
+            state.history['vote_result'] = {}
+            self.effects.append(History('###警长投票阶段###', False))
+            return GameEnum.STEP_FLAG_WAIT_FOR_ACTION
+        elif now is GameEnum.TURN_STEP_PK_VOTE:
+            state.history['vote_result'] = {}
+            self.effects.append(History('###PK投票阶段###', False))
+            return GameEnum.STEP_FLAG_WAIT_FOR_ACTION
+        elif now is GameEnum.TURN_STEP_ELECT_PK_VOTE:
+            state.history['vote_result'] = {}
+            self.effects.append(History('###警长PK投票阶段###', False))
+            return GameEnum.STEP_FLAG_WAIT_FOR_ACTION
+        elif now is GameEnum.TURN_STEP_ANNOUNCE:
+            if state.history['dying']:
+                self.effects.append(History('昨晚，以下位置的玩家倒下了，不分先后：{}'.format(
+                    ','.join([str(d) for d in sorted(map(int, state.history['dying']))])
+                ), True))
+            else:
+                self.effects.append(History("昨晚是平安夜", True))
+                self._drop_next((GameEnum.TURN_STEP_USE_SKILLS, GameEnum.TURN_STEP_LAST_WORDS))
+            return GameEnum.STEP_FLAG_AUTO_MOVE_ON
+        elif now is GameEnum.TURN_STEP_TURN_DAY:
+            state.status = GameEnum.GAME_STATUS_DAY
+            self.effects.append(Music('day_start_voice', 'day_bgm', False))
+            self.calculate_die_in_night()
+            self.effects.append(GameFields({
+                'days': state.days,
+            }))
+            return GameEnum.STEP_FLAG_AUTO_MOVE_ON
+        elif now is GameEnum.ROLE_TYPE_SEER:
+            self.effects.append(Music('seer_start_voice', 'seer_bgm', True))
+            # todo: move on after a random timeout when the seer is dead
+            return GameEnum.STEP_FLAG_WAIT_FOR_ACTION
+        elif now is GameEnum.ROLE_TYPE_WITCH:
+            self.effects.append(Music('witch_start_voice', 'witch_bgm', True))
+            # todo: move on after a random timeout when the witch is dead
+            return GameEnum.STEP_FLAG_WAIT_FOR_ACTION
+        elif now is GameEnum.ROLE_TYPE_SAVIOR:
+            self.effects.append(Music('savior_start_voice', 'savior_bgm', True))
+            # todo: move on after a random timeout when the savior is dead
+            return GameEnum.STEP_FLAG_WAIT_FOR_ACTION
+
+    def kill(self, pos: int, how: GameEnum):
+        state = self.state
+        logging.info(f'kill pos={pos},by {how.label}')
+        if pos < 1 or pos > state.get_seats_cnt():
+            return
+        state.invalidate_snapshot()
+        role = state.at(pos)
+
+        # todo 长老?
+
+        if role.role_type is GameEnum.ROLE_TYPE_IDIOT and how is GameEnum.SKILL_VOTE and not role.args['exposed']:
+            role.args['exposed'] = True
+            role.voteable = False
+            return
+
+        state.history['dying'][str(pos)] = True
+
+        if how is GameEnum.SKILL_TOXIC and role.role_type is GameEnum.ROLE_TYPE_HUNTER:
+            role.args['shootable'] = False
+
+        # todo: other link die
+        self.check_win()
+
+    def calculate_die_in_night(self):
+        history = self.state.history
+        wolf_kill_pos = history['wolf_kill_decision']
+        elixir = history['elixir']
+        guard = history['guard']
+
+        logging.info(f'wolf_kill_pos={wolf_kill_pos},elixir={elixir},guard={guard}')
+        if wolf_kill_pos > 0:
+            killed = True
+            if elixir:
+                killed = not killed
+            if guard == wolf_kill_pos:
+                killed = not killed
+
+            if killed:
+                self.kill(wolf_kill_pos, GameEnum.SKILL_WOLF_KILL)
+        if history['toxic'] > 0:
+            self.kill(history['toxic'], GameEnum.SKILL_TOXIC)
+        # todo: other death way in night?
+
+    def check_win(self):
+        state = self.state
+        dying = state.history['dying']
+        # which groups are left, by identity, hashing GameEnum members goes through Python code
+        wolves = gods = villagers = False
+        for r in state.roles:
+            if r.alive and (not dying or str(r.position) not in dying):
+                group = r.group_type
+                if group is GameEnum.GROUP_TYPE_WOLVES:
+                    wolves = True
+                elif group is GameEnum.GROUP_TYPE_GODS:
+                    gods = True
+                elif group is GameEnum.GROUP_TYPE_VILLAGERS:
+                    villagers = True
+
+        if not wolves:
+            raise GameFinished(state.gid, GameEnum.GROUP_TYPE_GOOD)
+
+        if state.victory_mode is GameEnum.VICTORY_MODE_KILL_GROUP and (not gods or not villagers):
+            raise GameFinished(state.gid, GameEnum.GROUP_TYPE_WOLVES)
+
+        if not gods and not villagers:
+            raise GameFinished(state.gid, GameEnum.GROUP_TYPE_WOLVES)
@@ -2,7 +2,7 @@ import json
 from sqlalchemy.ext.declarative import declarative_base, declared_attr
 from sqlalchemy.types import TypeDecorator, VARCHAR, INTEGER
 from werewolf.utils.enums import GameEnum
-from werewolf.utils.json_utils import ExtendedJSONEncoder, json_hook
+from werewolf.utils.json_utils import dumps, loads, json_hook
 
 
 class MySQLBase(object):
@@ -21,12 +21,37 @@ class JSONEncodedType(TypeDecorator):
 
     def process_bind_param(self, value, dialect):
         if value is not None:
-            value = json.dumps(value, cls=ExtendedJSONEncoder)
+            value = dumps(value)
         return value
 
     def process_result_value(self, value, dialect):
         if value is not None:
-            value = json.loads(value, object_hook=json_hook)
+            if '__GameEnum__' in value:
+                value = json.loads(value, object_hook=json_hook)
+            else:
+                value = loads(value)
+        return value
+
+
+class EnumListType(TypeDecorator):
+    """
+    List of GameEnum stored as their bare values, e.g. "602,603,604".
+    Rows still holding the JSON form ('[{"__GameEnum__": 602}, ...]') are decoded as well.
+    """
+    impl = VARCHAR
+
+    def process_bind_param(self, value, dialect):
+        if value is not None:
+            value = ','.join(str(e.value) for e in value)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is not None:
+            if value.startswith('['):
+                value = json.loads(value, object_hook=json_hook)
+            else:
+                members = GameEnum._value2member_map_  # skips the lookup machinery of GameEnum(v)
+                value = [members[int(v)] for v in value.split(',')] if value else []
         return value
 
 
@@ -1,8 +1,9 @@
 from sqlalchemy import Column, Integer, String, Boolean
 from sqlalchemy.ext.mutable import MutableDict, MutableList
 
-from .base import Base, EnumType, JSONEncodedType
-from werewolf.utils.enums import GameEnum
+from .base import Base, EnumType, EnumListType, JSONEncodedType
+from werewolf.engine import rules
+from werewolf.engine.state import RoleState, ROLE_FIELDS
 
 
 class Role(Base):
@@ -17,65 +18,25 @@ class Role(Base):
     voteable = Column(Boolean, nullable=False)
     speakable = Column(Boolean, nullable=False)
     position = Column(Integer, nullable=False)
-    skills = Column(MutableList.as_mutable(JSONEncodedType(255)), nullable=False)
-    tags = Column(MutableList.as_mutable(JSONEncodedType(255)), nullable=False)
+    skills = Column(MutableList.as_mutable(EnumListType(255)), nullable=False)
+    tags = Column(MutableList.as_mutable(EnumListType(255)), nullable=False)
     args = Column(MutableDict.as_mutable(JSONEncodedType(255)), nullable=False)
 
     def reset(self):
-        self.role_type = GameEnum.ROLE_TYPE_UNKNOWN
-        self.group_type = GameEnum.GROUP_TYPE_UNKNOWN
-        self.alive = True
-        # self.iscaptain = False
-        self.voteable = True
-        self.speakable = True
-        self.position = -1
-        self.skills = []
-        self.tags = []
-        self.args = {}
-
-    def prepare(self, captain_mode):
-        if self.role_type is GameEnum.ROLE_TYPE_SEER:
-            self.group_type = GameEnum.GROUP_TYPE_GODS
-        elif self.role_type is GameEnum.ROLE_TYPE_WITCH:
-            self.args = {'elixir': True, 'toxic': True}
-            self.group_type = GameEnum.GROUP_TYPE_GODS
-        elif self.role_type is GameEnum.ROLE_TYPE_HUNTER:
-            self.args = {'shootable': True}
-            self.group_type = GameEnum.GROUP_TYPE_GODS
-        elif self.role_type is GameEnum.ROLE_TYPE_SAVIOR:
-            self.args = {'guard': GameEnum.TARGET_NO_ONE.value}
-            self.group_type = GameEnum.GROUP_TYPE_GODS
-        elif self.role_type is GameEnum.ROLE_TYPE_VILLAGER:
-            self.group_type = GameEnum.GROUP_TYPE_VILLAGERS
-        elif self.role_type is GameEnum.ROLE_TYPE_NORMAL_WOLF:
-            self.group_type = GameEnum.GROUP_TYPE_WOLVES
-            self.tags.append(GameEnum.TAG_ATTACKABLE_WOLF)
-        elif self.role_type is GameEnum.ROLE_TYPE_IDIOT:
-            self.args = {'exposed': False}
-            self.group_type = GameEnum.GROUP_TYPE_GODS
-        else:
-            raise TypeError(f'Cannot prepare for role type {self.role_type}')
-
-        # prepare for skills
-        if self.role_type is GameEnum.ROLE_TYPE_UNKNOWN:
-            self.skills = []
-            return
-
-        skills = [GameEnum.SKILL_VOTE]
-        if captain_mode is GameEnum.CAPTAIN_MODE_WITH_CAPTAIN:
-            skills.append(GameEnum.SKILL_CAPTAIN)
-
-        if self.role_type is GameEnum.ROLE_TYPE_SEER:
-            skills.append(GameEnum.SKILL_DISCOVER)
-        if self.role_type is GameEnum.ROLE_TYPE_WITCH:
-            skills.append(GameEnum.SKILL_WITCH)
-        if self.role_type is GameEnum.ROLE_TYPE_HUNTER:
-            skills.append(GameEnum.SKILL_SHOOT)
-        if self.role_type is GameEnum.ROLE_TYPE_SAVIOR:
-            skills.append(GameEnum.SKILL_GUARD)
-        if GameEnum.TAG_ATTACKABLE_WOLF in self.tags:
-            skills.append(GameEnum.SKILL_WOLF_KILL)
-            skills.append(GameEnum.SKILL_SUICIDE)
-
-        self.skills = skills
-        return
+        rules.reset_role(self)
+
+    def to_state(self) -> RoleState:
+        state = RoleState.__new__(RoleState)
+        for f in ROLE_FIELDS:
+            setattr(state, f, getattr(self, f))
+        state.skills = list(state.skills)
+        state.tags = list(state.tags)
+        state.args = dict(state.args)
+        return state
+
+    def apply_state(self, state: RoleState):
+        # only what changed is assigned, an unchanged role stays clean for the write-behind flush
+        for f in ROLE_FIELDS:
+            value = getattr(state, f)
+            if getattr(self, f) != value:
+                setattr(self, f, value)
@@ -0,0 +1,100 @@
+import asyncio
+import contextvars
+import time
+from typing import Callable
+
+from werewolf.db.executor import run_in_db
+from werewolf.utils.enums import GameEnum
+from werewolf.utils.game_exceptions import GameFinished
+from .contention import contention
+from .store import game_store
+
+
+class GameActor(object):
+    """
+    Single writer of one game.
+
+    Commands wait in an in-memory mailbox and run one at a time against the live game,
+    which is what the `SELECT ... FOR UPDATE` on the game row used to guarantee.
+    They run in the database executor, so a slow query only holds up this game.
+    """
+
+    def __init__(self, gid: int):
+        self.gid = gid
+        self.last_active = time.monotonic()
+        self._busy = False
+        self._mailbox: asyncio.Queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    @property
+    def idle(self) -> bool:
+        return not self._busy and self._mailbox.empty()
+
+    async def call(self, fn: Callable, *args):
+        """Run a game command fn(live_game, *args)."""
+        return await self._enqueue(fn.__name__.lstrip('_'), self._execute, (fn, args))
+
+    async def run(self, fn: Callable, *args):
+        """Run fn(*args) in turn with the commands of this game."""
+        return await self._enqueue(fn.__name__, fn, args)
+
+    async def _enqueue(self, name: str, fn: Callable, args):
+        future = asyncio.get_event_loop().create_future()
+        queued = self._mailbox.qsize() + self._busy
+        self._mailbox.put_nowait((name, fn, args, future, contextvars.copy_context(), time.perf_counter(), queued))
+        return await future
+
+    def stop(self) -> None:
+        self._task.cancel()
+        while not self._mailbox.empty():
+            future = self._mailbox.get_nowait()[3]
+            if future is not None:
+                future.cancel()
+
+    async def _run(self) -> None:
+        while True:
+            name, fn, args, future, context, queued_at, queued = await self._mailbox.get()
+            if future is not None and future.done():  # the caller has gone away
+                continue
+            started = time.perf_counter()
+            self._busy = True
+            try:
+                # in the caller's context, so that its request is charged for the statements
+                result = await run_in_db(context.run, fn, *args)
+            except Exception as e:
+                if future is not None:
+                    future.set_exception(e)
+            else:
+                if future is not None:
+                    future.set_result(result)
+            finally:
+                self._busy = False
+                self.last_active = time.monotonic()
+                # the hold includes waiting for a db thread, the game is blocked all the same
+                contention.record(self.gid, name, started - queued_at, time.perf_counter() - started, queued)
+            if game_store.persist_due(self.gid):
+                # write back behind the command, the caller does not wait for it
+                self._mailbox.put_nowait(('flush', game_store.flush, (self.gid,), None, contextvars.Context(),
+                                          time.perf_counter(), self._mailbox.qsize()))
+
+    def _execute(self, fn: Callable, args):
+        live = game_store.get(self.gid)
+        readonly = getattr(fn, 'readonly', False)
+        checkpoint = live.checkpoint() if live is not None and not readonly else None
+        try:
+            result = fn(live, *args)
+        except GameFinished as finish:
+            live.publish()
+            live.finish(finish.winner)
+            live.touch()
+            game_store.save(live, now=True)
+            return GameEnum.OK.digest()
+        except Exception:
+            if checkpoint is not None:
+                # the command failed halfway, put the game back as it was before it
+                live.rollback(checkpoint)
+            raise
+        if live is not None and not readonly:
+            live.touch()
+            live.publish()
+        return result
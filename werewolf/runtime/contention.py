@@ -0,0 +1,80 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, List
+
+from werewolf.core.config import settings
+from werewolf.core.metrics import Histogram
+
+# commands take turns on their game, this is what waiting on the game row lock used to be
+GAME_COMMAND_WAIT = Histogram('werewolf_game_command_wait_seconds', 'Time game commands wait for their turn on the game',
+                              ['command'])
+GAME_COMMAND_HOLD = Histogram('werewolf_game_command_hold_seconds', 'Time game commands keep the other commands waiting',
+                              ['command'])
+
+
+class GameContention(object):
+    """Waiting and holding totals of the commands of one game."""
+    __slots__ = ('gid', 'commands', 'wait_seconds', 'hold_seconds', 'max_wait', 'max_queued', 'by_command')
+
+    def __init__(self, gid: int):
+        self.gid = gid
+        self.commands = 0
+        self.wait_seconds = 0.0
+        self.hold_seconds = 0.0
+        self.max_wait = 0.0
+        self.max_queued = 0  # commands found waiting ahead at once
+        self.by_command: Dict[str, List] = {}  # command -> [count, wait seconds, hold seconds]
+
+    def as_dict(self) -> dict:
+        return {
+            'gid': self.gid,
+            'commands': self.commands,
+            'wait_seconds': round(self.wait_seconds, 6),
+            'hold_seconds': round(self.hold_seconds, 6),
+            'max_wait_seconds': round(self.max_wait, 6),
+            'max_queued': self.max_queued,
+            'by_command': {name: {'count': n, 'wait_seconds': round(wait, 6), 'hold_seconds': round(hold, 6)}
+                           for name, (n, wait, hold) in sorted(self.by_command.items(), key=lambda i: -i[1][1])},
+        }
+
+
+class ContentionTracker(object):
+    """
+    Where games serialize: how long each command waited for its turn on the game and how long it
+    then held it. Kept for the CONTENTION_TRACKED_GAMES games most recently busy in this worker.
+    """
+
+    def __init__(self):
+        self._games: OrderedDict = OrderedDict()  # gid -> GameContention, most recently busy last
+        self._lock = threading.Lock()
+
+    def record(self, gid: int, command: str, wait: float, hold: float, queued: int = 0) -> None:
+        GAME_COMMAND_WAIT.observe(wait, command=command)
+        GAME_COMMAND_HOLD.observe(hold, command=command)
+        with self._lock:
+            game = self._games.pop(gid, None) or GameContention(gid)
+            self._games[gid] = game
+            while len(self._games) > settings.CONTENTION_TRACKED_GAMES:
+                self._games.popitem(last=False)
+            game.commands += 1
+            game.wait_seconds += wait
+            game.hold_seconds += hold
+            game.max_wait = max(game.max_wait, wait)
+            game.max_queued = max(game.max_queued, queued)
+            totals = game.by_command.setdefault(command, [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += wait
+            totals[2] += hold
+
+    def top(self, limit: int = 10) -> List[dict]:
+        """The games whose commands waited the longest in total."""
+        with self._lock:
+            games = sorted(self._games.values(), key=lambda g: g.wait_seconds, reverse=True)[:limit]
+            return [g.as_dict() for g in games]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._games.clear()
+
+
+contention = ContentionTracker()
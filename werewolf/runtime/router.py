@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Callable, Dict
+
+from fastapi.encoders import jsonable_encoder
+
+from werewolf.core.config import settings
+from werewolf.core.metrics import Gauge
+from werewolf.utils.json_utils import dumps, loads
+from werewolf.websocket.websocket import broadcaster
+from .actor import GameActor
+from .store import game_store
+
+COMMANDS: Dict[str, Callable] = {}
+
+
+def command(fn: Callable = None, *, readonly: bool = False) -> Callable:
+    """
+    Register a game command, so that it can be forwarded to the owning worker by name.
+    A command is called as fn(live_game, *args) and must take and return JSON friendly values.
+    Commands not marked readonly move the version of the live game.
+    """
+    def register(fn: Callable) -> Callable:
+        fn.readonly = readonly
+        COMMANDS[f'{fn.__module__}.{fn.__name__}'] = fn
+        return fn
+    return register(fn) if fn is not None else register
+
+
+class NotOwner(Exception):
+    pass
+
+
+def _int_keys(obj):
+    # JSON turns int keys (e.g. the cards counter) into strings, turn them back
+    if isinstance(obj, dict):
+        return {int(k) if k.lstrip('-').isdigit() else k: _int_keys(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_int_keys(v) for v in obj]
+    return obj
+
+
+class GameRouter(object):
+    """
+    Sends every command for a gid to the single worker owning that game.
+
+    Ownership is a Redis lease, claimed on first use and renewed while the game has an actor
+    in the worker. Commands for games owned by another worker are published on that worker's
+    channel and the reply is awaited, so each game is only mutated by one actor.
+    """
+
+    def __init__(self):
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self._actors: Dict[int, GameActor] = {}
+        Gauge('werewolf_game_actors', 'Games owned by this worker with a running actor', function=lambda: len(self._actors))
+        self._owners = {}  # gid -> (worker_id, valid_until)
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._tasks = set()
+
+    @staticmethod
+    def _channel(worker_id: str) -> str:
+        return f'werewolf:worker:{worker_id}'
+
+    @staticmethod
+    def _lease(gid: int) -> str:
+        return f'werewolf:owner:{gid}'
+
+    async def start(self) -> None:
+        self._spawn(self._listen())
+        self._spawn(self._renew())
+
+    async def stop(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        for gid in list(self._actors):
+            await self._drop(gid)
+
+    async def call(self, gid: int, fn: Callable, *args):
+        if gid < 0:
+            return fn(None, *args)
+        owner = await self._owner(gid)
+        if owner == self.worker_id:
+            return await self._actor(gid).call(fn, *args)
+        try:
+            return await self._forward(owner, gid, fn, args)
+        except NotOwner:
+            # the lease moved while the request was in flight, ask again once
+            self._owners.pop(gid, None)
+            owner = await self._owner(gid)
+            if owner == self.worker_id:
+                return await self._actor(gid).call(fn, *args)
+            return await self._forward(owner, gid, fn, args)
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _actor(self, gid: int) -> GameActor:
+        actor = self._actors.get(gid)
+        if actor is None:
+            actor = self._actors[gid] = GameActor(gid)
+        return actor
+
+    async def _owner(self, gid: int) -> str:
+        if gid in self._actors:
+            return self.worker_id
+        cached = self._owners.get(gid)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        backend = broadcaster.backend
+        owner = None
+        while owner is None:
+            if await backend.set_if_absent(self._lease(gid), self.worker_id, settings.GAME_OWNER_TTL):
+                owner = self.worker_id
+            else:
+                owner = await backend.get(self._lease(gid))  # None if it expired in between
+        self._owners[gid] = (owner, time.monotonic() + settings.GAME_OWNER_TTL / 3)
+        return owner
+
+    async def _forward(self, owner: str, gid: int, fn: Callable, args):
+        request_id = uuid.uuid4().hex
+        future = asyncio.get_event_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            await broadcaster.publish(self._channel(owner), dumps({
+                'id': request_id,
+                'reply_to': self.worker_id,
+                'gid': gid,
+                'command': f'{fn.__module__}.{fn.__name__}',
+                'args': args,
+            }))
+            return await asyncio.wait_for(future, settings.GAME_FORWARD_TIMEOUT)
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def _listen(self) -> None:
+        async with broadcaster.subscribe(self._channel(self.worker_id), max_size=0) as subscriber:
+            async for event in subscriber:
+                try:
+                    message = _int_keys(loads(event.message))
+                except ValueError:
+                    logging.exception(f'bad message on {event.channel}: {event.message!r}')
+                    continue
+                if 'command' in message:
+                    self._spawn(self._serve(message))
+                    continue
+                future = self._pending.get(message['id'])
+                if future is None or future.done():
+                    continue
+                if message.get('moved'):
+                    future.set_exception(NotOwner())
+                elif 'error' in message:
+                    future.set_exception(RuntimeError(message['error']))
+                else:
+                    future.set_result(message['result'])
+
+    async def _serve(self, message) -> None:
+        reply = {'id': message['id']}
+        gid = message['gid']
+        if await self._owner(gid) != self.worker_id:
+            reply['moved'] = True
+        else:
+            try:
+                result = await self._actor(gid).call(COMMANDS[message['command']], *message['args'])
+                reply['result'] = jsonable_encoder(result)
+            except Exception as e:
+                logging.exception(f'forwarded command {message["command"]} failed, gid={gid}')
+                reply['error'] = repr(e)
+        await broadcaster.publish(self._channel(message['reply_to']), dumps(reply))
+
+    async def _renew(self) -> None:
+        backend = broadcaster.backend
+        while True:
+            await asyncio.sleep(settings.GAME_OWNER_TTL / 3)
+            now = time.monotonic()
+            for gid, actor in list(self._actors.items()):
+                try:
+                    if actor.idle and now - actor.last_active > settings.GAME_STATE_IDLE_TIMEOUT:
+                        await self._drop(gid)
+                    elif await backend.get(self._lease(gid)) != self.worker_id:
+                        logging.warning(f'lost the lease of game {gid}, dropping the live copy')
+                        await self._drop(gid, release=False)
+                    else:
+                        await backend.expire(self._lease(gid), settings.GAME_OWNER_TTL)
+                except Exception:
+                    logging.exception(f'failed to renew the lease of game {gid}')
+
+    async def _drop(self, gid: int, release: bool = True) -> None:
+        actor = self._actors[gid]
+        # write back through the mailbox, so it cannot race a command in the executor
+        await actor.run(game_store.release if release else game_store.evict, gid)
+        if release and not actor.idle:
+            return  # busy again, keep the game
+        del self._actors[gid]
+        actor.stop()
+        self._owners.pop(gid, None)
+        broadcaster.forget_seq(gid)
+        if release:
+            await broadcaster.backend.delete(self._lease(gid))
+
+
+game_router = GameRouter()
@@ -0,0 +1,211 @@
+import logging
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
+
+from werewolf.core.config import settings
+from werewolf.core.metrics import Gauge
+from werewolf.db.session import SessionLocal
+from werewolf.engine import Engine, GameState, RoleState
+from werewolf.models import Game, Role
+from werewolf.utils.enums import GameEnum
+from werewolf.websocket.websocket import publish_effects, publish_history
+
+
+class LiveGame(object):
+    """
+    The authoritative copy of one game inside this worker.
+
+    Endpoints read and change `game`, a GameState, and its `roles`, RoleStates by uid. The game
+    row and its role rows stay attached to a private session which never expires them, `persist`
+    writes what changed in the state back to them; MySQL is only read again to recover an evicted game.
+    """
+
+    def __init__(self, db: Session, game: Game):
+        self.db = db
+        self.gid = game.gid
+        self.game_row = game
+        self.role_rows: Dict[int, Role] = {r.uid: r for r in db.query(Role).filter(Role.gid == game.gid).all()}
+        self.game = game.to_state(self.role_rows.values())
+        self.roles: Dict[int, RoleState] = {r.uid: r for r in self.game.roles}
+        self.persisted_step_cnt = game.step_cnt
+        self.persist_pending = False
+        # the epoch tells versions of this copy from those of an earlier or later load
+        self.epoch = uuid.uuid4().hex[:8]
+        self.mutations = 0
+        self.public_states: OrderedDict = OrderedDict()  # snapshot key -> public game state, newest last
+        self.effects: list = []  # produced by the running command, published once it went through
+        db.commit()  # hand the connection back to the pool until the next write-back
+
+    @property
+    def snapshot_key(self) -> str:
+        return f'{self.epoch}-{self.game.snapshot_serial}'
+
+    @property
+    def version(self) -> str:
+        # starts with the snapshot key, so a version tells which public state it was served with
+        return f'{self.snapshot_key}.{self.game.step_cnt}.{self.mutations}'
+
+    def touch(self) -> None:
+        """Called by the actor after every command which may have changed the game."""
+        self.mutations += 1
+
+    def remember_public_state(self, key: str, state: dict) -> None:
+        self.public_states[key] = state
+        while len(self.public_states) > settings.GAME_INFO_VERSIONS:
+            self.public_states.popitem(last=False)
+
+    def restore(self, state: GameState) -> None:
+        """Puts back a copy of the state taken before, e.g. GameState.copy()."""
+        self.game = state
+        self.roles = {r.uid: r for r in state.roles}
+
+    def checkpoint(self):
+        """What rollback puts back, taken by the actor before a command which may change the game."""
+        return self.game.copy(), dict(self.role_rows)
+
+    def rollback(self, checkpoint) -> None:
+        state, self.role_rows = checkpoint
+        self.restore(state)
+        self.effects = []
+        # role rows changed by add_role / remove_role are read again on their next use
+        self.db.rollback()
+
+    def transition(self, step: Callable, *args):
+        """Runs an Engine step on the game, what it produced is kept for publish, also when the game is won midway."""
+        engine = Engine(self.game)
+        try:
+            return step(engine, *args)
+        finally:
+            self.effects.extend(engine.effects)
+
+    def publish(self) -> None:
+        """Publishes the effects of the command, called by the actor once it did not fail."""
+        effects, self.effects = self.effects, []
+        publish_effects(self.gid, effects)
+
+    def role(self, uid: int) -> Optional[RoleState]:
+        return self.roles.get(uid)
+
+    def add_role(self, uid: int) -> RoleState:
+        row = self.role_rows[uid] = self.db.query(Role).get(uid)
+        row.gid = self.gid
+        row.reset()
+        role = self.roles[uid] = row.to_state()
+        self.game.seat(self.roles.values())
+        return role
+
+    def remove_role(self, uid: int) -> None:
+        row = self.role_rows.pop(uid, None) or self.db.query(Role).get(uid)
+        row.gid = -1
+        row.reset()
+        self.roles.pop(uid, None)
+        self.game.seat(self.roles.values())
+
+    def finish(self, winner: GameEnum):
+        publish_history(self.gid, f'游戏结束，{winner.label}胜利')
+        game = self.game
+        game.invalidate_snapshot()
+        game.status = GameEnum.GAME_STATUS_FINISHED
+        original_players = game.players
+        game.init_game()
+        game.players = original_players
+        for p in self.roles.values():
+            p.reset()
+        game.seat(self.roles.values())
+
+    def persist(self):
+        self.game_row.apply_state(self.game)
+        for uid, role in self.roles.items():
+            self.role_rows[uid].apply_state(role)
+        try:
+            self.db.commit()
+        except SQLAlchemyError:
+            self.db.rollback()
+            raise
+        self.persisted_step_cnt = self.game.step_cnt
+        self.persist_pending = False
+
+
+class GameStateStore(object):
+    """
+    In-process store of live games keyed by gid, with write-behind persistence.
+
+    Lobby operations are written back immediately, in-game actions stay in memory until the
+    step counter moves (or the game ends), then the game actor commits them behind the command.
+    A game must only be live in one worker at a time, and only touched by its actor.
+    """
+
+    def __init__(self):
+        self._games: Dict[int, LiveGame] = {}
+        Gauge('werewolf_live_games', 'Games held in memory by this worker', function=lambda: len(self._games))
+
+    def get(self, gid: int) -> Optional[LiveGame]:
+        live = self._games.get(gid)
+        if live is None:
+            if gid < 0:
+                return None
+            db = SessionLocal(expire_on_commit=False)
+            try:
+                game = db.query(Game).get(gid)
+            except SQLAlchemyError:
+                db.close()
+                raise
+            if game is None:
+                db.close()
+                return None
+            live = self._games[gid] = LiveGame(db, game)
+        return live
+
+    def save(self, live: LiveGame, now: bool = False) -> None:
+        if now:
+            self._persist(live)
+        elif live.game.step_cnt != live.persisted_step_cnt:
+            live.persist_pending = True
+
+    def persist_due(self, gid: int) -> bool:
+        live = self._games.get(gid)
+        return live is not None and live.persist_pending
+
+    def flush(self, gid: int) -> None:
+        live = self._games.get(gid)
+        if live is not None and live.persist_pending:
+            try:
+                self._persist(live)
+            except SQLAlchemyError:
+                pass
+
+    def persist_all(self) -> None:
+        for live in list(self._games.values()):
+            try:
+                self._persist(live)
+            except SQLAlchemyError:
+                pass
+
+    def release(self, gid: int) -> None:
+        live = self._games.get(gid)
+        if live is not None:
+            try:
+                self._persist(live)
+            except SQLAlchemyError:
+                return
+            self.evict(gid)
+
+    def evict(self, gid: int) -> None:
+        live = self._games.pop(gid, None)
+        if live is not None:
+            live.db.close()
+
+    def _persist(self, live: LiveGame) -> None:
+        try:
+            live.persist()
+        except SQLAlchemyError:
+            logging.exception(f'failed to persist game {live.gid}, reloading it from MySQL next time')
+            self.evict(live.gid)
+            raise
+
+
+game_store = GameStateStore()
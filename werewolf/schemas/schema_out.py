@@ -26,3 +26,5 @@ class UserInfoOut(ResponseBase):
 class GameInfoOut(ResponseBase):
     game: Optional[GameBase]
     role: Optional[RoleBase]
+    version: Optional[str]
+    delta: Optional[bool]
@@ -12,6 +12,10 @@ class GameEnum(Enum):
     def __bool__(self):
         return self is GameEnum.OK
 
+    def __json__(self):
+        # picked up by ujson, members are serialized as their bare values
+        return str(self._value_)
+
     def digest(self, *args, **kwargs):
         return {'code': self.value, 'msg': self.label.format(*args), **kwargs}
 
@@ -138,3 +142,6 @@ class GameEnum(Enum):
 
     # 1500
     CONNECTION_WS_4001_NOT_IN_GAME = (1500, 4001)
+    CONNECTION_WS_1013_TOO_SLOW = (1501, 1013)
+    CONNECTION_WS_1001_IDLE = (1502, 1001)
+    CONNECTION_WS_1011_SERVER_ERROR = (1503, 1011)
@@ -3,7 +3,7 @@ from sqlalchemy.orm import Session
 
 
 class GameFinished(Exception):
-    def __init__(self, gid: int, winner: GameEnum, db: Session):
+    def __init__(self, gid: int, winner: GameEnum, db: Session = None):
         self.gid = gid
         self.winner = winner
         self.db = db
@@ -1,28 +1,29 @@
-import json
+from typing import Any
 
-from functools import singledispatch
+import ujson
+from starlette.responses import JSONResponse
 from werewolf.utils.enums import GameEnum
 
 
-@singledispatch
-def convert(o):
-    raise TypeError('not special type')
+def dumps(obj: Any) -> str:
+    """
+    Serializer for everything leaving the process: ORM columns, WebSocket messages and HTTP responses.
+    GameEnum members are written as their bare values, see GameEnum.__json__.
+    """
+    return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False)
 
 
-@convert.register(GameEnum)
-def _(o):
-    return {'__GameEnum__': o.value}
+def loads(s: str) -> Any:
+    return ujson.loads(s)
 
 
-class ExtendedJSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        try:
-            return convert(obj)
-        except TypeError:
-            return super().default(obj)
+class UJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content).encode('utf-8')
 
 
 def json_hook(d):
+    # the tagged {'__GameEnum__': value} form of rows written before the enum lists were compacted
     if '__GameEnum__' in d:
         return GameEnum(d['__GameEnum__'])
     else:
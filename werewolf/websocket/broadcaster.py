@@ -1,15 +1,50 @@
 import asyncio
 import asyncio_redis
+import time
 import typing
+import uuid
+from collections import deque
 from contextlib import asynccontextmanager
 from urllib.parse import urlparse
 import logging
 
+from werewolf.core.config import settings
+from werewolf.core.metrics import Counter, Gauge
+from werewolf.utils.json_utils import loads
+from .coalesce import coalesce
+from .event_log import EventLog
+from .publisher import Publisher
+
+OVERFLOW_POLICIES = ('drop_oldest', 'disconnect', 'coalesce')
+
+SUBSCRIBER_DROPPED = Counter('werewolf_subscriber_dropped_messages_total',
+                             'Messages dropped from full subscriber queues', ['policy'])
+SUBSCRIBER_DISCONNECTED = Counter('werewolf_subscriber_disconnected_total',
+                                  'Subscribers disconnected for falling too far behind')
+BROADCAST_EVENTS = Counter('werewolf_broadcast_events_total', 'Messages handed to subscribers of this worker',
+                           ['source'])
+SUBSCRIBER_LATE = Counter('werewolf_subscriber_late_messages_total',
+                          'Messages that waited longer than SUBSCRIBER_LATE_SECONDS in a subscriber queue')
+
 
 class Event:
-    def __init__(self, channel, message):
+    def __init__(self, channel, message, seq=None):
         self.channel = channel
         self.message = message
+        self.seq = seq
+        self.received_at = time.monotonic()
+        self._state_keys = None
+
+    def state_keys(self) -> typing.Optional[frozenset]:
+        """The game fields a SOCKET_GAME message sets, None for any other message."""
+        if self._state_keys is None:
+            try:
+                data = loads(self.message)
+                keys = frozenset(data['game']) if data.get('mutation') == 'SOCKET_GAME' else frozenset()
+            except (ValueError, TypeError, KeyError, AttributeError):
+                keys = frozenset()
+            self._state_keys = keys
+        return self._state_keys or None
 
     def __eq__(self, other):
         return (
@@ -44,19 +79,137 @@ class RedisBackend(object):
     async def publish(self, channel: str, message: typing.Any) -> None:
         await self._pub_conn.publish(channel, message)
 
+    async def publish_many(self, messages: typing.List[typing.Tuple[str, typing.Any]]) -> None:
+        # asyncio_redis writes each command right away, so these are pipelined on the connection
+        await asyncio.gather(*[self._pub_conn.publish(channel, message) for channel, message in messages])
+
     async def next_published(self) -> Event:
         message = await self._subscriber.next_published()
         return Event(channel=message.channel, message=message.value)
 
+    async def set_if_absent(self, key: str, value: str, expire: int) -> bool:
+        reply = await self._pub_conn.set(key, value, expire=expire, only_if_not_exists=True)
+        return reply is not None
+
+    async def get(self, key: str) -> typing.Optional[str]:
+        return await self._pub_conn.get(key)
+
+    async def expire(self, key: str, expire: int) -> None:
+        await self._pub_conn.expire(key, expire)
+
+    async def delete(self, key: str) -> None:
+        await self._pub_conn.delete([key])
+
+    async def set(self, key: str, value: str, expire: int) -> None:
+        await self._pub_conn.set(key, value, expire=expire)
+
+    async def push_capped(self, key: str, values: typing.List[str], size: int, expire: int) -> None:
+        await asyncio.gather(self._pub_conn.rpush(key, values), self._pub_conn.ltrim(key, -size, -1),
+                             self._pub_conn.expire(key, expire))
+
+    async def list_range(self, key: str) -> typing.List[str]:
+        reply = await self._pub_conn.lrange(key)
+        return await reply.aslist()
+
+
+class MemoryBackend(object):
+    """
+    Redis stand-in for a single worker, picked with REDIS_URL=memory:// for local runs and load
+    tests. There are no other workers, so nothing published ever needs to come back.
+    """
+
+    def __init__(self, url: str):
+        self._values: typing.Dict[str, typing.Tuple[typing.Any, float]] = {}  # key -> (value, expires at)
+
+    async def connect(self) -> None:
+        pass
+
+    async def disconnect(self) -> None:
+        pass
+
+    async def subscribe(self, channel: str) -> None:
+        pass
+
+    async def unsubscribe(self, channel: str) -> None:
+        pass
+
+    async def publish(self, channel: str, message: typing.Any) -> None:
+        pass
+
+    async def publish_many(self, messages: typing.List[typing.Tuple[str, typing.Any]]) -> None:
+        pass
+
+    async def next_published(self) -> Event:
+        # the broadcaster delivers to the subscribers of this worker itself
+        return await asyncio.get_event_loop().create_future()
+
+    def _get(self, key: str) -> typing.Any:
+        value, expires_at = self._values.get(key, (None, 0))
+        if expires_at < time.monotonic():
+            self._values.pop(key, None)
+            return None
+        return value
+
+    def _set(self, key: str, value: typing.Any, expire: int) -> None:
+        self._values[key] = (value, time.monotonic() + expire)
+
+    async def set_if_absent(self, key: str, value: str, expire: int) -> bool:
+        if self._get(key) is not None:
+            return False
+        self._set(key, value, expire)
+        return True
+
+    async def get(self, key: str) -> typing.Optional[str]:
+        return self._get(key)
+
+    async def expire(self, key: str, expire: int) -> None:
+        value = self._get(key)
+        if value is not None:
+            self._set(key, value, expire)
+
+    async def delete(self, key: str) -> None:
+        self._values.pop(key, None)
+
+    async def set(self, key: str, value: str, expire: int) -> None:
+        self._set(key, value, expire)
+
+    async def push_capped(self, key: str, values: typing.List[str], size: int, expire: int) -> None:
+        self._set(key, ((self._get(key) or []) + values)[-size:], expire)
+
+    async def list_range(self, key: str) -> typing.List[str]:
+        return list(self._get(key) or [])
+
 
 class Unsubscribed(Exception):
     pass
 
 
+class SlowConsumer(Exception):
+    """Raised to a subscriber that was cut off because its queue overflowed."""
+
+
 class Broadcaster:
+    """
+    Messages go straight to the subscribers of this worker and through Redis to the other ones.
+
+    What goes to Redis is tagged with the id of the sending broadcaster, so the copy that comes
+    back through our own subscription is dropped instead of being delivered twice, and with the
+    sequence number of messages kept in the event log.
+    """
+
     def __init__(self, url: str):
+        self.id = uuid.uuid4().hex
         self._subscribers = {}
-        self._backend = RedisBackend(url)
+        self._backend = MemoryBackend(url) if urlparse(url).scheme == 'memory' else RedisBackend(url)
+        Gauge('werewolf_broadcast_subscribers', 'Subscribers of this worker on all channels',
+              function=lambda: sum(len(s) for s in list(self._subscribers.values())))
+        Gauge('werewolf_broadcast_channels', 'Channels this worker subscribes to', function=lambda: len(self._subscribers))
+        self._publisher = Publisher(self._publish_batch, settings.PUBLISH_BATCH_SIZE, settings.PUBLISH_COALESCE_WINDOW)
+        self.loop: typing.Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def backend(self) -> RedisBackend:
+        return self._backend
 
     async def __aenter__(self) -> 'Broadcaster':
         await self.connect()
@@ -66,10 +219,14 @@ class Broadcaster:
         await self.disconnect()
 
     async def connect(self) -> None:
+        self.loop = asyncio.get_event_loop()
         await self._backend.connect()
+        self._event_log = EventLog(self._backend, settings.EVENT_LOG_SIZE, settings.EVENT_LOG_TTL)
         self._listener_task = asyncio.create_task(self._listener())
+        self._publisher.start()
 
     async def disconnect(self) -> None:
+        await self._publisher.stop()
         if self._listener_task.done():
             self._listener_task.result()
         else:
@@ -79,37 +236,135 @@ class Broadcaster:
     async def _listener(self) -> None:
         while True:
             event = await self._backend.next_published()
-            for queue in list(self._subscribers.get(event.channel, [])):
-                await queue.put(event)
+            origin, _, message = event.message.partition('|')
+            if origin == self.id:
+                continue
+            seq, _, event.message = message.partition('|')
+            event.seq = int(seq) if seq else None
+            BROADCAST_EVENTS.inc(source='redis')
+            self._deliver(event)
+
+    def _deliver(self, event: Event) -> None:
+        # never wait on a subscriber here, a stalled one must not hold up the others
+        for subscriber in list(self._subscribers.get(event.channel, [])):
+            subscriber.put_nowait(event)
+
+    def _publish_local(self, channel: str, message: typing.Any, seq: typing.Optional[int] = None) -> str:
+        if channel in self._subscribers:
+            BROADCAST_EVENTS.inc(source='local')
+            self._deliver(Event(channel, message, seq))
+        return f'{self.id}|{"" if seq is None else seq}|{message}'
 
     async def publish(self, channel: str, message: typing.Any) -> None:
-        await self._backend.publish(str(channel), message)
+        channel = str(channel)
+        await self._backend.publish(channel, self._publish_local(channel, message))
+
+    async def _publish_batch(self, messages: typing.List[typing.Tuple[str, typing.Any, bool]]) -> None:
+        messages = coalesce(messages)
+        logged = [(channel, message) for channel, message, log in messages if log]
+        stamped = await self._event_log.number(logged) if logged else []
+        numbered = iter(stamped)
+        out = []
+        for channel, message, log in messages:
+            if log:
+                seq, message = next(numbered)
+                out.append((channel, self._publish_local(channel, message, seq)))
+            else:
+                out.append((channel, self._publish_local(channel, message)))
+        # the local subscribers have them already, Redis gets the messages and the log in one go
+        if logged:
+            await asyncio.gather(self._backend.publish_many(out), self._event_log.append(logged, stamped))
+        else:
+            await self._backend.publish_many(out)
+
+    def forget_seq(self, channel: str) -> None:
+        """Called when this worker stops publishing to a game channel, see EventLog."""
+        self._event_log.forget(str(channel))
+
+    def publish_nowait(self, channel: str, message: typing.Any, log: bool = False) -> None:
+        """
+        Queue a message for the next batch, safe to call from any thread. Logged messages are
+        numbered and can be replayed with replay().
+        """
+        self.loop.call_soon_threadsafe(self._publisher.put, (str(channel), message, log))
+
+    async def replay(self, channel: str, last_seq: int) -> typing.Optional[typing.List[typing.Tuple[int, str]]]:
+        return await self._event_log.since(str(channel), last_seq)
 
     @asynccontextmanager
-    async def subscribe(self, channel: str) -> 'Subscriber':
-        queue: asyncio.Queue = asyncio.Queue()
+    async def subscribe(self, channel: str, max_size: int = None, policy: str = None) -> 'Subscriber':
+        """
+        max_size defaults to SUBSCRIBER_QUEUE_SIZE, 0 means unbounded and is meant for
+        in-process consumers that never block, policy defaults to SUBSCRIBER_OVERFLOW_POLICY.
+        """
+        if max_size is None:
+            max_size = settings.SUBSCRIBER_QUEUE_SIZE
+        subscriber = Subscriber(max_size, policy or settings.SUBSCRIBER_OVERFLOW_POLICY)
 
         try:
             if not self._subscribers.get(channel):
                 await self._backend.subscribe(channel)
-                self._subscribers[channel] = set([queue])
+                self._subscribers[channel] = set([subscriber])
             else:
-                self._subscribers[channel].add(queue)
+                self._subscribers[channel].add(subscriber)
             logging.info(f'Start subscribe channel:{channel}')
-            yield Subscriber(queue)
+            yield subscriber
         finally:
             logging.info(f'Finish subscribe channel:{channel}')
-            self._subscribers[channel].remove(queue)
+            self._subscribers[channel].remove(subscriber)
             if not self._subscribers.get(channel):
                 del self._subscribers[channel]
                 await self._backend.unsubscribe(channel)
             logging.debug('quiting queue')
-            await queue.put(None)
+            subscriber.close()
 
 
 class Subscriber:
-    def __init__(self, queue):
-        self._queue = queue
+    def __init__(self, max_size: int = 0, policy: str = 'drop_oldest'):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f'Unknown overflow policy {policy!r}, expected one of {OVERFLOW_POLICIES}')
+        self._events: typing.Deque[Event] = deque()
+        self._ready = asyncio.Event()
+        self._max_size = max_size
+        self._policy = policy
+        self._closed = False
+        self.overflowed = False
+
+    def put_nowait(self, event: Event) -> None:
+        if self._closed:
+            return
+        if self._max_size and len(self._events) >= self._max_size and not self._make_room(event):
+            return
+        self._events.append(event)
+        self._ready.set()
+
+    def _make_room(self, event: Event) -> bool:
+        if self._policy == 'coalesce':
+            # a queued game update whose fields are all set again by this one is out of date
+            keys = event.state_keys()
+            if keys is not None:
+                for queued in self._events:
+                    queued_keys = queued.state_keys()
+                    if queued_keys is not None and queued_keys <= keys:
+                        self._events.remove(queued)
+                        SUBSCRIBER_DROPPED.inc(policy=self._policy)
+                        return True
+        elif self._policy == 'drop_oldest':
+            self._events.popleft()
+            SUBSCRIBER_DROPPED.inc(policy=self._policy)
+            return True
+        # nothing can go, the client would miss history, so cut it off and let it reconnect
+        SUBSCRIBER_DROPPED.inc(len(self._events) + 1, policy=self._policy)
+        SUBSCRIBER_DISCONNECTED.inc()
+        logging.warning(f'subscriber fell {len(self._events)} messages behind, disconnecting')
+        self._events.clear()
+        self.overflowed = True
+        self.close()
+        return False
+
+    def close(self) -> None:
+        self._closed = True
+        self._ready.set()
 
     async def __aiter__(self):
         try:
@@ -119,7 +374,14 @@ class Subscriber:
             pass
 
     async def get(self) -> Event:
-        item = await self._queue.get()
-        if item is None:
-            raise Unsubscribed()
-        return item
+        while not self._events:
+            if self._closed:
+                if self.overflowed:
+                    raise SlowConsumer()
+                raise Unsubscribed()
+            self._ready.clear()
+            await self._ready.wait()
+        event = self._events.popleft()
+        if time.monotonic() - event.received_at > settings.SUBSCRIBER_LATE_SECONDS:
+            SUBSCRIBER_LATE.inc()
+        return event
@@ -0,0 +1,40 @@
+import typing
+
+from werewolf.core.metrics import Counter
+from werewolf.utils.json_utils import dumps
+
+COALESCED_MESSAGES = Counter('werewolf_coalesced_messages_total', 'SOCKET_GAME updates merged into an earlier frame')
+
+
+class GameUpdate(object):
+    """Game fields for a SOCKET_GAME frame, encoded only once the batch is coalesced."""
+    __slots__ = ('fields',)
+
+    def __init__(self, fields: typing.Dict[str, typing.Any]):
+        self.fields = fields
+
+
+def coalesce(messages: typing.List[typing.Tuple[str, typing.Any, bool]]) -> typing.List[typing.Tuple[str, typing.Any, bool]]:
+    """
+    Merge the GameUpdates of a batch into one SOCKET_GAME frame per channel, later fields win.
+
+    Messages are (channel, message, log) as queued by Broadcaster.publish_nowait. Any other
+    message on the channel ends the run, so frames keep their order relative to history, audio
+    and player-out messages.
+    """
+    out = []
+    open_frames = {}  # channel -> index in out of the frame still taking updates
+    for channel, message, log in messages:
+        if isinstance(message, GameUpdate):
+            index = open_frames.get(channel)
+            if index is None:
+                open_frames[channel] = len(out)
+                out.append((channel, dict(message.fields), log))
+            else:
+                out[index][1].update(message.fields)
+                COALESCED_MESSAGES.inc()
+        else:
+            open_frames.pop(channel, None)
+            out.append((channel, message, log))
+    return [(channel, dumps({'game': message, 'mutation': 'SOCKET_GAME'}) if isinstance(message, dict) else message, log)
+            for channel, message, log in out]
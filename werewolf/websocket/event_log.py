@@ -0,0 +1,91 @@
+import asyncio
+import typing
+
+from werewolf.core.metrics import Counter
+
+EVENT_LOG_REPLAYED = Counter('werewolf_event_log_replayed_total', 'Events replayed to reconnecting clients')
+EVENT_LOG_RESYNCS = Counter('werewolf_event_log_resyncs_total',
+                            'Reconnects whose missed events were no longer in the log')
+
+
+def with_seq(message: str, seq: int) -> str:
+    # the frames are JSON objects, the client sends the last seq it got back on reconnect
+    if message.startswith('{') and message != '{}':
+        return f'{{"seq":{seq},{message[1:]}'
+    return message
+
+
+class EventLog(object):
+    """
+    A capped log of the messages sent to each game channel, numbered per channel.
+
+    Only the worker owning a game publishes to its channel, so it numbers the messages itself and
+    local subscribers get them without waiting for Redis. The counter is read from Redis the first
+    time a channel is seen and written back with the entries, so numbering carries on when the game
+    moves to another worker, which is why the owner calls forget() when it lets a game go. Entries
+    are kept in a Redis list as "<seq>|<message>", the newest `size` of them and for `ttl` seconds
+    after the last one.
+    """
+
+    def __init__(self, backend, size: int, ttl: int):
+        self._backend = backend
+        self._size = size
+        self._ttl = ttl
+        self._last: typing.Dict[str, int] = {}  # channel -> last seq given out here
+
+    @staticmethod
+    def _seq_key(channel: str) -> str:
+        return f'werewolf:seq:{channel}'
+
+    @staticmethod
+    def _log_key(channel: str) -> str:
+        return f'werewolf:events:{channel}'
+
+    def forget(self, channel: str) -> None:
+        self._last.pop(channel, None)
+
+    async def number(self, messages: typing.List[typing.Tuple[str, str]]) -> typing.List[typing.Tuple[int, str]]:
+        """Returns (seq, message with its seq) for each message, Redis is only asked for new channels."""
+        unknown = list({channel for channel, _ in messages if channel not in self._last})
+        if unknown:
+            lasts = await asyncio.gather(*[self._backend.get(self._seq_key(channel)) for channel in unknown])
+            self._last.update((channel, int(last or 0)) for channel, last in zip(unknown, lasts))
+        stamped = []
+        for channel, message in messages:
+            seq = self._last[channel] = self._last[channel] + 1
+            stamped.append((seq, with_seq(message, seq)))
+        return stamped
+
+    async def append(self, messages: typing.List[typing.Tuple[str, str]],
+                     stamped: typing.List[typing.Tuple[int, str]]) -> None:
+        """Logs the messages as numbered by number(), with the counter of their channels."""
+        entries: typing.Dict[str, typing.List[str]] = {}
+        lasts: typing.Dict[str, int] = {}
+        for (channel, _), (seq, message) in zip(messages, stamped):
+            entries.setdefault(channel, []).append(f'{seq}|{message}')
+            lasts[channel] = seq
+        writes = []
+        for channel, channel_entries in entries.items():
+            writes.append(self._backend.push_capped(self._log_key(channel), channel_entries, self._size, self._ttl))
+            writes.append(self._backend.set(self._seq_key(channel), str(lasts[channel]), self._ttl))
+        await asyncio.gather(*writes)
+
+    async def since(self, channel: str, last_seq: int) -> typing.Optional[typing.List[typing.Tuple[int, str]]]:
+        """
+        The events after last_seq, or None when some of them are gone and the client has to
+        fetch the whole state again.
+        """
+        newest, entries = await asyncio.gather(self._backend.get(self._seq_key(channel)),
+                                               self._backend.list_range(self._log_key(channel)))
+        newest = int(newest or 0)
+        events = []
+        for entry in entries:
+            seq, _, message = entry.partition('|')
+            events.append((int(seq), message))
+        oldest = events[0][0] if events else newest + 1
+        if last_seq > newest or oldest > last_seq + 1:
+            EVENT_LOG_RESYNCS.inc()
+            return None
+        missed = [event for event in events if event[0] > last_seq]
+        EVENT_LOG_REPLAYED.inc(len(missed))
+        return missed
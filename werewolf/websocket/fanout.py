@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import typing
+
+from fastapi import WebSocket
+
+from werewolf.core.config import settings
+from werewolf.core.metrics import Counter, Gauge
+from werewolf.utils.enums import GameEnum
+from werewolf.utils.json_utils import dumps
+from .broadcaster import Broadcaster, Event
+
+WS_SEND_FAILURES = Counter('werewolf_ws_send_failures_total', 'WebSocket clients dropped because a send failed or timed out')
+
+
+class Connection(object):
+    """One info_ws client of a channel, events before `last_seq` are not sent to it again."""
+
+    def __init__(self, websocket: WebSocket, last_seq: typing.Optional[int] = None):
+        self.websocket = websocket
+        self.last_seq = last_seq
+        # events arriving while missed ones are replayed wait here, None once the client is live
+        self._backlog: typing.Optional[typing.List[Event]] = []
+
+    async def replay(self, missed: typing.Optional[typing.List[typing.Tuple[int, str]]]) -> None:
+        if missed is None:
+            self.last_seq = None
+            await self.websocket.send_text(dumps({'action': 'getGameInfo'}))
+        else:
+            for self.last_seq, message in missed:
+                await self.websocket.send_text(message)
+        while self._backlog:
+            await self._send(self._backlog.pop(0))
+        self._backlog = None
+
+    async def send(self, event: Event) -> None:
+        if self._backlog is not None:
+            self._backlog.append(event)
+        else:
+            await self._send(event)
+
+    async def _send(self, event: Event) -> None:
+        if self.last_seq is not None and event.seq is not None and event.seq <= self.last_seq:
+            return
+        await self.websocket.send_text(event.message)
+
+
+class Fanout(object):
+    """
+    The info_ws clients of one channel, fed by a single subscription and task.
+
+    Each event is written once to all of them concurrently. A client whose send fails or takes
+    longer than WEBSOCKET_SEND_TIMEOUT is closed, so it cannot hold up the others for long. The
+    subscription is unbounded: what piles up behind a stalled client is bounded by that timeout,
+    and a bounded one would cut off every client of the channel when it overflowed.
+    """
+
+    def __init__(self, broadcaster: Broadcaster, channel: str):
+        self.channel = channel
+        self.connections: typing.Set[Connection] = set()
+        self._broadcaster = broadcaster
+        self.ready = asyncio.Event()  # set once subscribed, events from then on reach the clients
+        self._task = asyncio.create_task(self._run())
+        self._task.add_done_callback(self._report)
+
+    @property
+    def running(self) -> bool:
+        return not self._task.done()
+
+    def stop(self) -> None:
+        self._task.cancel()
+
+    async def wait_ready(self) -> bool:
+        """False if the fan-out stopped before it could subscribe."""
+        ready = asyncio.ensure_future(self.ready.wait())
+        await asyncio.wait([ready, self._task], return_when=asyncio.FIRST_COMPLETED)
+        ready.cancel()
+        return self.ready.is_set()
+
+    async def _run(self) -> None:
+        try:
+            async with self._broadcaster.subscribe(channel=self.channel, max_size=0) as subscriber:
+                self.ready.set()
+                async for event in subscriber:
+                    connections = list(self.connections)
+                    results = await asyncio.gather(
+                        *[asyncio.wait_for(c.send(event), settings.WEBSOCKET_SEND_TIMEOUT) for c in connections],
+                        return_exceptions=True)
+                    for connection, result in zip(connections, results):
+                        if isinstance(result, Exception):
+                            logging.debug(f'dropping client of channel={self.channel}: {result!r}')
+                            WS_SEND_FAILURES.inc()
+                            await self._close(connection, GameEnum.CONNECTION_WS_1013_TOO_SLOW)
+        except Exception:
+            await self._close_all(GameEnum.CONNECTION_WS_1011_SERVER_ERROR)
+            raise
+
+    async def _close_all(self, code: GameEnum) -> None:
+        for connection in list(self.connections):
+            await self._close(connection, code)
+
+    async def _close(self, connection: Connection, code: GameEnum) -> None:
+        self.connections.discard(connection)
+        try:
+            await connection.websocket.close(code=code.label)
+        except Exception:
+            pass  # already gone
+
+    @staticmethod
+    def _report(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logging.error('fan-out stopped', exc_info=task.exception())
+
+
+class FanoutRegistry(object):
+    """The fan-outs of the channels that have info_ws clients in this worker."""
+
+    def __init__(self, broadcaster: Broadcaster):
+        self._broadcaster = broadcaster
+        self._fanouts: typing.Dict[str, Fanout] = {}
+        Gauge('werewolf_ws_channels', 'Channels with WebSocket clients in this worker', function=lambda: len(self._fanouts))
+
+    def join(self, channel: str, connection: Connection) -> Fanout:
+        fanout = self._fanouts.get(channel)
+        if fanout is None or not fanout.running:
+            fanout = self._fanouts[channel] = Fanout(self._broadcaster, channel)
+        fanout.connections.add(connection)
+        return fanout
+
+    def leave(self, channel: str, connection: Connection) -> None:
+        fanout = self._fanouts.get(channel)
+        if fanout is None:
+            return
+        fanout.connections.discard(connection)
+        if not fanout.connections:
+            del self._fanouts[channel]
+            fanout.stop()
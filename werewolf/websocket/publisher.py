@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import time
+import typing
+
+from werewolf.core.metrics import Counter, Gauge, Histogram
+
+PUBLISH_FLUSH_SECONDS = Histogram('werewolf_publish_flush_seconds', 'Time to send one batch of messages to Redis')
+PUBLISH_BATCH_SIZE = Histogram('werewolf_publish_batch_size', 'Messages per batch sent to Redis',
+                               buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+PUBLISH_DELAY = Histogram('werewolf_publish_delay_seconds',
+                          'Time from publishing a message to sending its batch, for the oldest message of each batch')
+PUBLISH_ERRORS = Counter('werewolf_publish_errors_total', 'Messages lost because their batch failed')
+
+
+class Publisher(object):
+    """
+    Queues outgoing messages and sends them from a single flusher task.
+
+    Whatever piled up while the previous batch was in flight goes out as the next batch, with
+    the PUBLISH commands pipelined on the connection instead of one task and round trip each.
+    """
+
+    def __init__(self, send: typing.Callable[[list], typing.Awaitable], max_batch: int, window: float = 0):
+        self._send = send
+        self._max_batch = max_batch
+        self._window = window
+        self._queue: typing.Optional[asyncio.Queue] = None
+        self._task: typing.Optional[asyncio.Task] = None
+        self._stopping = False
+        Gauge('werewolf_publish_queue_depth', 'Messages waiting to be sent to Redis', function=self.depth)
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._stopping = False
+        self._task = asyncio.create_task(self._flush_forever())
+        self._task.add_done_callback(self._report)
+
+    async def stop(self, timeout: float = 5) -> None:
+        # let the batch in flight and the queued messages go out before the connection closes
+        if self._task.done():
+            return
+        self._stopping = True
+        self._queue.put_nowait(None)  # wakes the flusher if the queue is empty
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f'dropped {self.depth()} messages on shutdown')
+
+    def put(self, item: typing.Tuple) -> None:
+        """Must be called from the event loop thread, item starts with the channel and the message."""
+        self._queue.put_nowait((time.perf_counter(), item))
+
+    def _take(self) -> typing.List[typing.Tuple]:
+        batch = []
+        while not self._queue.empty() and len(batch) < self._max_batch:
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _flush_forever(self) -> None:
+        while not (self._stopping and self._queue.empty()):
+            batch = [await self._queue.get()]
+            if self._window and not self._stopping:
+                # messages of one request come from a worker thread a few callbacks apart
+                await asyncio.sleep(self._window)
+            batch.extend(self._take())
+            batch = [entry for entry in batch if entry is not None]  # the wake-up of stop
+            if batch:
+                await self._flush(batch)
+
+    async def _flush(self, batch) -> None:
+        start = time.perf_counter()
+        PUBLISH_DELAY.observe(start - batch[0][0])
+        batch = [item for _, item in batch]
+        try:
+            await self._send(batch)
+        except Exception:
+            PUBLISH_ERRORS.inc(len(batch))
+            logging.exception(f'failed to publish {len(batch)} messages')
+        finally:
+            PUBLISH_FLUSH_SECONDS.observe(time.perf_counter() - start)
+            PUBLISH_BATCH_SIZE.observe(len(batch))
+
+    @staticmethod
+    def _report(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logging.error('publisher stopped', exc_info=task.exception())
@@ -1,56 +1,67 @@
 import asyncio
 import logging
+import time
 import typing
-from fastapi import WebSocket, Depends
+from fastapi import WebSocket, HTTPException
 # from starlette.concurrency import run_until_first_complete
 from starlette.websockets import WebSocketDisconnect
-from pydantic import ValidationError
-from jose import jwt
-from sqlalchemy.orm import Session
-import json
-from json import JSONDecodeError
 
 
-from werewolf.core import security
 from werewolf.core.config import settings
+from werewolf.core.metrics import Counter, Gauge
+from werewolf.core.principal import principal_cache
 from .broadcaster import Broadcaster
-from werewolf.models import User
+from .coalesce import GameUpdate
+from .fanout import Connection, FanoutRegistry
 from werewolf.api import deps
+from werewolf.db.executor import run_in_db
+from werewolf.engine import History, Music, GameFields, PlayerOut
 from werewolf.utils.enums import GameEnum
-from werewolf.schemas.token import TokenPayload
+from werewolf.utils.json_utils import dumps
 
 broadcaster = Broadcaster(settings.REDIS_URL)
+fanouts = FanoutRegistry(broadcaster)
+PRINCIPAL_CHANNEL = 'werewolf:principal'
 
+_last_seen: typing.Dict[int, float] = {}  # id of each open info_ws connection -> when its client was last heard from
 
-async def run_until_first_complete(*args: typing.Tuple[typing.Callable, dict]) -> None:
-    tasks = [asyncio.create_task(handler(**kwargs)) for handler, kwargs in args]
-    (done, pending) = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
-    logging.debug('first finished')
-    logging.debug('done ' + str(done))
-    logging.debug('pending ' + str(pending))
-    [task.cancel() for task in pending]
-    [task.result() for task in done]
-    logging.debug('task done!')
 
+def _count_zombies() -> int:
+    deadline = time.monotonic() - settings.HEARTBEAT_TIMEOUT
+    return sum(1 for seen in list(_last_seen.values()) if seen < deadline)
 
-async def info_ws_sender(websocket, channel):
-    try:
-        async with broadcaster.subscribe(channel=str(channel)) as subscriber:
-            async for event in subscriber:
-                await websocket.send_text(event.message)
-            logging.debug('Finishing sender')
-    except asyncio.CancelledError:
-        logging.debug(f'sender with channel={channel} canceled')
-        raise
+
+WS_LIVE = Gauge('werewolf_ws_connections_live', 'WebSocket clients heard from within HEARTBEAT_TIMEOUT',
+                function=lambda: len(_last_seen) - _count_zombies())
+WS_ZOMBIE = Gauge('werewolf_ws_connections_zombie', 'WebSocket clients quiet for longer than HEARTBEAT_TIMEOUT',
+                  function=_count_zombies)
+WS_REAPED = Counter('werewolf_ws_reaped_total', 'WebSocket clients closed for being quiet past WEBSOCKET_IDLE_TIMEOUT')
 
 
 async def info_ws_heartbeat(websocket):
+    # any frame from the client counts, close the ones quiet for too long instead of keeping them in
+    # the fan-out of their channel; a dead connection is found by the WebSocket ping / pong of the
+    # server (uvicorn's ws_ping_interval), which browsers answer on their own
+    key = id(websocket)
+    _last_seen[key] = time.monotonic()
     try:
         while True:
-            await asyncio.wait_for(websocket.receive_json(), settings.HEARTBEAT_TIMEOUT)
-            logging.debug('heartbeat')
-    except (asyncio.TimeoutError, WebSocketDisconnect, JSONDecodeError) as err:
+            try:
+                await asyncio.wait_for(websocket.receive_text(), settings.HEARTBEAT_INTERVAL)
+                _last_seen[key] = time.monotonic()
+                logging.debug('heartbeat')
+                continue
+            except asyncio.TimeoutError:
+                pass
+            if time.monotonic() - _last_seen[key] > settings.WEBSOCKET_IDLE_TIMEOUT:
+                WS_REAPED.inc()
+                logging.debug('Reaping idle websocket')
+                await websocket.close(code=GameEnum.CONNECTION_WS_1001_IDLE.label)
+                return
+    except WebSocketDisconnect as err:
         logging.debug('Finishing heartbeat ' + str(err))
+    finally:
+        _last_seen.pop(key, None)
 
 
 def init_websocket(app):
@@ -63,16 +74,11 @@ def init_websocket(app):
     async def info_ws(
         websocket: WebSocket,
         token: str,
-        db: Session = Depends(deps.get_db),
+        last_seq: int = None,
     ):
         try:
-            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[security.ALGORITHM])
-            token_data = TokenPayload(**payload)
-        except (jwt.JWTError, ValidationError):
-            await websocket.close(code=GameEnum.CONNECTION_WS_4001_NOT_IN_GAME.label)
-            return
-        user = db.query(User).get(token_data.sub)
-        if not user:
+            user = await run_in_db(deps.get_principal, token)
+        except HTTPException:
             await websocket.close(code=GameEnum.CONNECTION_WS_4001_NOT_IN_GAME.label)
             return
 
@@ -80,19 +86,43 @@ def init_websocket(app):
             await websocket.close(code=GameEnum.CONNECTION_WS_4001_NOT_IN_GAME.label)
             return
         await websocket.accept()
-        await run_until_first_complete(
-            # (chatroom_ws_receiver, {"websocket": websocket}),
-            (info_ws_heartbeat, {"websocket": websocket}),
-            (info_ws_sender, {"websocket": websocket, "channel": user.gid}),
-        )
+        # the only task of a client is this one reading from it, events are sent by the fan-out
+        channel = str(user.gid)
+        connection = Connection(websocket, last_seq)
+        fanout = fanouts.join(channel, connection)
+        try:
+            if not await fanout.wait_ready():
+                await websocket.close(code=GameEnum.CONNECTION_WS_1011_SERVER_ERROR.label)
+                return
+            await connection.replay(await broadcaster.replay(channel, last_seq) if last_seq is not None else [])
+            await info_ws_heartbeat(websocket)
+        finally:
+            fanouts.leave(channel, connection)
+
+
+async def listen_principal_invalidation():
+    async with broadcaster.subscribe(channel=PRINCIPAL_CHANNEL, max_size=0) as subscriber:
+        async for event in subscriber:
+            principal_cache.invalidate(int(event.message))
+
+
+def invalidate_principal(uid):
+    # drop the cached principal here and in the other workers
+    principal_cache.invalidate(uid)
+    broadcaster.publish_nowait(PRINCIPAL_CHANNEL, str(uid))
 
 
 def publish_info(channel, message):
-    asyncio.create_task(broadcaster.publish(channel=channel, message=message))
+    broadcaster.publish_nowait(channel, message, log=True)
+
+
+def publish_game(channel, fields):
+    # merged with the other SOCKET_GAME updates to the channel sent in the same batch
+    broadcaster.publish_nowait(channel, GameUpdate(fields), log=True)
 
 
 def publish_history(channel, message, show=True):
-    publish_info(channel, json.dumps({
+    publish_info(channel, dumps({
         'history': message,
         'show': show,
         'mutation': 'SOCKET_HISTORY'
@@ -100,7 +130,7 @@ def publish_history(channel, message, show=True):
 
 
 def publish_music(channel, instruction, bgm, bgm_loop):
-    publish_info(channel, json.dumps({
+    publish_info(channel, dumps({
         'bgm': {
             'file': bgm,
             'loop': bgm_loop
@@ -110,3 +140,22 @@ def publish_music(channel, instruction, bgm, bgm_loop):
         },
         'mutation': 'SOCKET_AUDIO'
     }))
+
+
+def publish_effects(channel, effects):
+    """Publishes what an engine transition returned, in order."""
+    for effect in effects:
+        kind = type(effect)
+        if kind is History:
+            publish_history(channel, effect.message, effect.show)
+        elif kind is Music:
+            publish_music(channel, effect.instruction, effect.bgm, effect.bgm_loop)
+        elif kind is GameFields:
+            publish_game(channel, effect.fields)
+        elif kind is PlayerOut:
+            publish_info(channel, dumps({
+                'pos': effect.pos,
+                'mutation': 'SOCKET_PLAYER_OUT'
+            }))
+        else:
+            raise TypeError(f'Unknown effect {effect!r}')